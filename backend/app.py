@@ -6,20 +6,43 @@ Web-Spec 后端服务
 """
 
 import os
+import re
+import sys
 import json
+import math
+import time
+import gzip
+import base64
 import sqlite3
-from datetime import datetime, timedelta
+import tarfile
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 import jwt
-from flask import Flask, request, jsonify, session, redirect, url_for
+from flask import Flask, Request, request, jsonify, session, redirect, url_for, send_file
 from flask_cors import CORS
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from google_auth_oauthlib.flow import Flow
 import requests
+from werkzeug.exceptions import RequestEntityTooLarge, RequestedRangeNotSatisfiable
 from werkzeug.utils import secure_filename
+from urllib.parse import quote
 import hashlib
+import hmac
+
+try:
+    import brotli  # 可选依赖，未安装时只生成gzip副本
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl  # Windows上不可用，blob_lock退化为进程内锁
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-production')
@@ -40,31 +63,1558 @@ DATABASE = os.getenv('DATABASE_URL', 'database/web-spec.db')
 JWT_SECRET = os.getenv('JWT_SECRET', 'jwt-secret-change-in-production')
 JWT_EXPIRE_HOURS = int(os.getenv('JWT_EXPIRE_HOURS', '24'))
 
+# SQLite连接池配置
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '8'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHED_STATEMENTS = 256
+
 # 上传配置
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'upload')
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'txt', 'json', 'specs', 'html', 'md', 'py', 'js', 'ts', 'tsx', 'jsx', 'css', 'xml', 'log'}
 
+# 断点续传配置：分片追加到暂存目录，完成后原子重命名到用户目录
+STAGING_FOLDER = os.path.join(UPLOAD_FOLDER, '.staging')
+UPLOAD_SESSION_MAX_SIZE = int(os.getenv('UPLOAD_SESSION_MAX_SIZE', str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 3600)))
+UPLOAD_SESSION_MAX_OPEN = int(os.getenv('UPLOAD_SESSION_MAX_OPEN', '20'))
+
+# 批量上传配置：单个请求的总大小和文件数上限
+BATCH_UPLOAD_MAX_SIZE = int(os.getenv('BATCH_UPLOAD_MAX_SIZE', str(256 * 1024 * 1024)))
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', '500'))
+
+# 用户存储配额（字节/文件数），0表示不限制；用量由user_storage表随上传和删除增量维护
+USER_QUOTA_BYTES = int(os.getenv('USER_QUOTA_BYTES', '0'))
+USER_QUOTA_FILES = int(os.getenv('USER_QUOTA_FILES', '0'))
+
+# 内容寻址存储：上传内容按sha256只保存一份，用户目录中的文件为指向blob的硬链接
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, '.blobs')
+
+# 按需加载的specs顶层字段：ingest时从主文档拆出，单独保存为blob旁的side文件，读取时显式include才返回
+SPLIT_SECTIONS = {'raw_api_response': '.raw'}
+
+# specs内容直接透传磁盘字节（上传时已校验），关闭后回退为解析后重新序列化
+SPECS_PASSTHROUGH = os.getenv('SPECS_PASSTHROUGH', 'true').lower() != 'false'
+
+# 下载卸载：鉴权后只返回X-Accel-Redirect（nginx）或X-Sendfile（Apache/lighttpd）头，由前端代理发送文件内容
+# DOWNLOAD_ACCEL_PREFIX为nginx中映射到upload目录的internal location
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/_protected/upload/')
+
+# specs文件URL带时间戳且内容不可变，允许客户端长期缓存
+SPECS_CACHE_MAX_AGE = int(os.getenv('SPECS_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+
+# 预压缩副本配置：小于阈值或压缩收益不足的文件不生成副本；
+# 超过上限的文件也不生成，避免单个压缩任务运行过久
+PRECOMPRESS_MIN_SIZE = int(os.getenv('PRECOMPRESS_MIN_SIZE', '1024'))
+PRECOMPRESS_MAX_SIZE = int(os.getenv('PRECOMPRESS_MAX_SIZE', str(32 * 1024 * 1024)))
+PRECOMPRESS_BROTLI_QUALITY = int(os.getenv('PRECOMPRESS_BROTLI_QUALITY', '11'))
+PRECOMPRESS_MAX_RATIO = 0.9
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# 列表分页配置
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 缓存配置
+SPECS_METADATA_CACHE_SIZE = int(os.getenv('SPECS_METADATA_CACHE_SIZE', '4096'))
+USER_NAME_CACHE_SIZE = int(os.getenv('USER_NAME_CACHE_SIZE', '10000'))
+USER_ROW_CACHE_SIZE = int(os.getenv('USER_ROW_CACHE_SIZE', '10000'))
+USER_ROW_CACHE_TTL = int(os.getenv('USER_ROW_CACHE_TTL', '300'))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+INVALID_TOKEN_CACHE_TTL = int(os.getenv('INVALID_TOKEN_CACHE_TTL', '30'))
+
+# 运行统计接口的访问令牌：未配置时/api/system/stats只允许本机直接访问
+SYSTEM_STATS_TOKEN = os.getenv('SYSTEM_STATS_TOKEN', '')
+
+# 令牌注销索引：多进程部署时各进程按此间隔从数据库同步其他进程的注销记录
+REVOCATION_SYNC_INTERVAL = int(os.getenv('REVOCATION_SYNC_INTERVAL', '30'))
+REVOCATION_BLOOM_BITS = 1 << 20
+REVOCATION_BLOOM_HASHES = 4
+
+# 后台维护：清理过期/失效会话、增量回收空闲页并更新统计信息
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', '3600'))
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
+INCREMENTAL_VACUUM_PAGES = int(os.getenv('INCREMENTAL_VACUUM_PAGES', '1000'))
+
+# 后台任务队列：上传后的派生处理（预压缩副本等）由工作线程异步执行
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+# 运行中的任务定期更新心跳，超过此时长（秒）没有心跳的任务视为进程中断，重新排队
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '600'))
+JOB_HEARTBEAT_INTERVAL = max(JOB_TIMEOUT / 4, 1)
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', str(7 * 24 * 3600)))
+
+# 令牌桶限流：按路由配置“每分钟请求数/突发容量”，0表示不限流；登录用户按用户计数，匿名请求按客户端IP计数
+RATE_LIMITS = {
+    'contexts_list': os.getenv('RATE_LIMIT_CONTEXTS_LIST', '60/20'),
+    'specs_content': os.getenv('RATE_LIMIT_SPECS_CONTENT', '600/100'),
+    'upload': os.getenv('RATE_LIMIT_UPLOAD', '120/30'),
+    'upload_batch': os.getenv('RATE_LIMIT_UPLOAD_BATCH', '10/3'),
+}
+# memory：每个进程独立计数；sqlite：多个工作进程通过rate_limit_buckets表共享令牌桶
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory').lower()
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', '100000'))
+# 部署在反向代理之后时设置为可信代理的层数，按X-Forwarded-For中由最外层可信代理追加的地址识别客户端IP
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '0'))
+
+# .specs流式扫描每次读取的字节数
+SPECS_SCAN_CHUNK_SIZE = 16 * 1024
+
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+class WebSpecRequest(Request):
+    """批量上传接口使用单独的请求体大小上限"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_batch':
+            return BATCH_UPLOAD_MAX_SIZE
+        return super().max_content_length
+
+app.request_class = WebSpecRequest
+
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_user_upload_dir(user_uuid):
-    """获取用户的上传目录"""
+class LRUCache:
+    """线程安全的有界LRU缓存，记录命中/未命中次数
+
+    指定ttl（秒）时条目在到期后视为未命中；set也可以为单个条目指定到期时间。
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, expires_at = self._data[key]
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class SQLitePool:
+    """SQLite连接池：复用连接、统一设置PRAGMA，并缓存预编译语句
+
+    用法与sqlite3连接的上下文管理器一致：正常退出时提交，异常时回滚。
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def _open(self):
+        conn = sqlite3.connect(
+            DATABASE,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            while self._idle:
+                path, conn = self._idle.pop()
+                if path == DATABASE:
+                    self.reused += 1
+                    return conn
+                # 数据库路径已变化，丢弃旧连接
+                conn.close()
+                self.discarded += 1
+            self.opened += 1
+        return self._open()
+
+    def _release(self, conn, healthy):
+        with self._lock:
+            self.in_use -= 1
+            if healthy and len(self._idle) < self.max_idle:
+                self._idle.append((DATABASE, conn))
+                return
+            self.discarded += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._acquire()
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+            raise
+        healthy = False
+        try:
+            with conn:
+                yield conn
+            healthy = True
+        finally:
+            self._release(conn, healthy)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'max_idle': self.max_idle,
+                'opened': self.opened,
+                'reused': self.reused,
+                'discarded': self.discarded
+            }
+
+db_pool = SQLitePool(SQLITE_POOL_SIZE)
+
+def get_db():
+    """从连接池获取数据库连接，配合with语句使用"""
+    return db_pool.connection()
+
+# .specs元数据缓存，键为(路径, mtime_ns, size)，文件变化后自然失效
+specs_metadata_cache = LRUCache(SPECS_METADATA_CACHE_SIZE)
+
+# 文件内容哈希缓存，键同上
+file_etag_cache = LRUCache(SPECS_METADATA_CACHE_SIZE)
+
+# 用户名缓存 uuid -> name，get_or_create_user更新资料时失效；不存在的用户缓存为空字符串
+user_name_cache = LRUCache(USER_NAME_CACHE_SIZE)
+
+# 用户记录缓存 id -> row，带TTL，get_or_create_user更新资料时失效
+user_row_cache = LRUCache(USER_ROW_CACHE_SIZE, ttl=USER_ROW_CACHE_TTL)
+
+# 已验证令牌缓存，键为令牌sha256摘要，条目在令牌exp时过期
+verified_token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
+# 无效令牌短期负缓存，避免重复的无效令牌反复验签
+invalid_token_cache = LRUCache(TOKEN_CACHE_SIZE, ttl=INVALID_TOKEN_CACHE_TTL)
+
+class RevocationIndex:
+    """已注销令牌(jti)的内存索引
+
+    布隆过滤器做快速预检，命中后再查jti -> exp字典；条目在令牌过期后清除，
+    清除时重建布隆过滤器。注销记录持久化在revoked_tokens表中，
+    启动时加载，并定期增量同步其他进程写入的记录。
+    """
+
+    def __init__(self, bits=REVOCATION_BLOOM_BITS, hashes=REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._bloom = bytearray(bits // 8)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._last_sync = 0.0
+        self.checks = 0
+        self.bloom_negatives = 0
+        self.revoked_hits = 0
+
+    def _positions(self, jti):
+        digest = hashlib.sha256(jti.encode('utf-8')).digest()
+        return [
+            int.from_bytes(digest[i * 4:(i + 1) * 4], 'big') % self.bits
+            for i in range(self.hashes)
+        ]
+
+    def _add_locked(self, jti, expires_at):
+        self._entries[jti] = expires_at
+        for position in self._positions(jti):
+            self._bloom[position >> 3] |= 1 << (position & 7)
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._add_locked(jti, expires_at)
+
+    def is_revoked(self, jti):
+        if not jti:
+            return False
+        self.maybe_sync()
+        self.checks += 1
+        for position in self._positions(jti):
+            if not self._bloom[position >> 3] & (1 << (position & 7)):
+                self.bloom_negatives += 1
+                return False
+        with self._lock:
+            expires_at = self._entries.get(jti)
+        if expires_at is None or expires_at <= time.time():
+            return False
+        self.revoked_hits += 1
+        return True
+
+    def load(self):
+        """从数据库加载全部未过期的注销记录"""
+        with get_db() as conn:
+            rows = conn.execute(
+                'SELECT id, jti, expires_at FROM revoked_tokens WHERE expires_at > ?',
+                (int(time.time()),)
+            ).fetchall()
+            max_id = conn.execute('SELECT MAX(id) FROM revoked_tokens').fetchone()[0]
+        with self._lock:
+            self._bloom = bytearray(self.bits // 8)
+            self._entries = {}
+            for row in rows:
+                self._add_locked(row['jti'], row['expires_at'])
+            self._last_id = max_id or 0
+            self._last_sync = time.time()
+
+    def maybe_sync(self):
+        """距上次同步超过REVOCATION_SYNC_INTERVAL时增量读取新的注销记录"""
+        if time.time() - self._last_sync < REVOCATION_SYNC_INTERVAL:
+            return
+        self._last_sync = time.time()
+        try:
+            with get_db() as conn:
+                rows = conn.execute(
+                    'SELECT id, jti, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id',
+                    (self._last_id,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            app.logger.warning(f"同步令牌注销记录失败: {str(e)}")
+            return
+        with self._lock:
+            for row in rows:
+                self._add_locked(row['jti'], row['expires_at'])
+                self._last_id = max(self._last_id, row['id'])
+        self.purge_expired()
+
+    def purge_expired(self):
+        """清除已过期的条目并重建布隆过滤器，返回清除数量"""
+        now = time.time()
+        with self._lock:
+            live = {jti: exp for jti, exp in self._entries.items() if exp > now}
+            purged = len(self._entries) - len(live)
+            if purged:
+                self._bloom = bytearray(self.bits // 8)
+                self._entries = {}
+                for jti, expires_at in live.items():
+                    self._add_locked(jti, expires_at)
+        return purged
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'size': size,
+            'checks': self.checks,
+            'bloom_negatives': self.bloom_negatives,
+            'revoked_hits': self.revoked_hits
+        }
+
+revocation_index = RevocationIndex()
+
+def parse_rate_limit(spec):
+    """解析“每分钟请求数/突发容量”，返回(每秒补充的令牌数, 桶容量)，不限流时返回None"""
+    rate, _, burst = (spec or '0').partition('/')
+    per_minute = float(rate)
+    if per_minute <= 0:
+        return None
+    return per_minute / 60, float(burst) if burst else per_minute
+
+class RateLimiter:
+    """按(路由, 用户或IP)维护令牌桶，记录各路由放行和拒绝的次数
+
+    memory模式下令牌桶保存在有界的OrderedDict中，超出上限时淘汰最久未访问的桶（淘汰的桶视为已充满）；
+    sqlite模式下保存在rate_limit_buckets表中，每次请求一条UPSERT，多个工作进程共享同一组令牌桶。
+    """
+
+    def __init__(self, limits, store='memory', max_buckets=100000):
+        self.specs = dict(limits)
+        self.limits = {route: parse_rate_limit(spec) for route, spec in limits.items()}
+        self.store = store
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = {route: 0 for route in limits}
+        self.limited = {route: 0 for route in limits}
+        self.evictions = 0
+        self.store_errors = 0
+
+    def idle_seconds(self):
+        """令牌桶从空到满所需的最长时间，超过此时长未访问的桶可以直接删除"""
+        return max((capacity / rate for rate, capacity in filter(None, self.limits.values())), default=0)
+
+    def _acquire_memory(self, bucket_key, rate, capacity, now):
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(bucket_key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[bucket_key] = (tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return tokens, allowed
+
+    def _acquire_sqlite(self, bucket_key, rate, capacity, now):
+        with get_db() as conn:
+            row = conn.execute('''
+                INSERT INTO rate_limit_buckets (key, tokens, allowed, updated_at)
+                VALUES (:key, :capacity - 1, 1, :now)
+                ON CONFLICT(key) DO UPDATE SET
+                    tokens = CASE WHEN MIN(:capacity, tokens + (:now - updated_at) * :rate) >= 1
+                                  THEN MIN(:capacity, tokens + (:now - updated_at) * :rate) - 1
+                                  ELSE MIN(:capacity, tokens + (:now - updated_at) * :rate) END,
+                    allowed = MIN(:capacity, tokens + (:now - updated_at) * :rate) >= 1,
+                    updated_at = :now
+                RETURNING tokens, allowed
+            ''', {'key': bucket_key, 'capacity': capacity, 'rate': rate, 'now': now}).fetchone()
+            conn.commit()
+        return row['tokens'], bool(row['allowed'])
+
+    def acquire(self, route, key):
+        """为请求消耗一个令牌，放行时返回0，否则返回建议的重试等待秒数"""
+        limit = self.limits.get(route)
+        if limit is None:
+            return 0
+        rate, capacity = limit
+        bucket_key = f"{route}:{key}"
+        now = time.time()
+        if self.store == 'sqlite':
+            try:
+                tokens, allowed = self._acquire_sqlite(bucket_key, rate, capacity, now)
+            except sqlite3.Error as e:
+                # 限流存储不可用时放行，不影响正常请求
+                app.logger.warning(f"限流计数失败: {str(e)}")
+                self.store_errors += 1
+                tokens, allowed = capacity, True
+        else:
+            tokens, allowed = self._acquire_memory(bucket_key, rate, capacity, now)
+        
+        with self._lock:
+            if allowed:
+                self.allowed[route] += 1
+            else:
+                self.limited[route] += 1
+        if allowed:
+            return 0
+        return max(1, math.ceil((1 - tokens) / rate))
+
+    def purge_idle(self):
+        """删除已充满的sqlite令牌桶，返回删除的行数"""
+        if self.store != 'sqlite':
+            return 0
+        return delete_in_batches(
+            'DELETE FROM rate_limit_buckets WHERE key IN '
+            '(SELECT key FROM rate_limit_buckets WHERE updated_at < ? LIMIT ?)',
+            (time.time() - self.idle_seconds(),)
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'store': self.store,
+                'buckets': len(self._buckets),
+                'max_buckets': self.max_buckets,
+                'evictions': self.evictions,
+                'store_errors': self.store_errors,
+                'routes': {
+                    route: {'limit': self.specs[route], 'allowed': self.allowed[route], 'limited': self.limited[route]}
+                    for route in self.specs
+                }
+            }
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_STORE, RATE_LIMIT_MAX_BUCKETS)
+
+def get_staging_path(session_id):
+    """获取断点续传会话的暂存文件路径"""
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    return os.path.join(STAGING_FOLDER, f"{session_id}.part")
+
+def get_blob_path(content_hash):
+    """获取内容哈希对应的blob路径（.blobs/<前两位>/<sha256>）"""
+    blob_dir = os.path.join(BLOB_FOLDER, content_hash[:2])
+    os.makedirs(blob_dir, exist_ok=True)
+    return os.path.join(blob_dir, content_hash)
+
+class BlobLock:
+    """保护blob的创建、链接和按引用计数删除：进程内线程锁加blob目录下锁文件的flock
+
+    多个工作进程共享同一上传目录，只用线程锁时一个进程的上传可能在另一个进程删除无引用blob的
+    同时链接同一个blob。锁文件在首次使用时按进程打开，fork出的子进程重新打开，不共用父进程的文件描述。
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is None:
+            return self
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+                self._file = open(self.lock_path, 'a')
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+blob_lock = BlobLock(os.path.join(BLOB_FOLDER, '.lock'))
+
+_UPLOAD_SHARD_PATTERN = re.compile(r'^(\d{4})(\d{2})\d{2}_')
+
+def upload_shard(filename):
+    """按文件名开头的时间戳返回分片子目录（yyyy/mm），无法识别日期的文件返回None"""
+    match = _UPLOAD_SHARD_PATTERN.match(filename)
+    return os.path.join(match.group(1), match.group(2)) if match else None
+
+def sharded_upload_path(user_uuid, filename):
+    """返回文件在分片布局下的路径（<uuid>/<yyyy>/<mm>/<文件名>），无法识别日期的文件保存在用户目录根下"""
+    shard = upload_shard(filename)
+    if shard is None:
+        return os.path.join(UPLOAD_FOLDER, user_uuid, filename)
+    return os.path.join(UPLOAD_FOLDER, user_uuid, shard, filename)
+
+def get_upload_path(user_uuid, filename):
+    """定位用户上传的文件，不列目录
+
+    优先使用分片布局；shard-uploads迁移完成前回退到扁平布局（<uuid>/<文件名>）。
+    两处都不存在时返回分片路径。迁移先建链接再删除旧路径，任一时刻至少有一处可见。
+    """
+    sharded_path = sharded_upload_path(user_uuid, filename)
+    if os.path.exists(sharded_path):
+        return sharded_path
+    flat_path = os.path.join(UPLOAD_FOLDER, user_uuid, filename)
+    if os.path.exists(flat_path):
+        return flat_path
+    return sharded_path
+
+def iter_user_upload_files(user_uuid):
+    """遍历用户目录（扁平布局和yyyy/mm分片）中的上传文件名，仅供重建索引等全量任务使用"""
     user_dir = os.path.join(UPLOAD_FOLDER, user_uuid)
-    os.makedirs(user_dir, exist_ok=True)
-    return user_dir
+    if not os.path.isdir(user_dir):
+        return
+    for root, dirs, files in os.walk(user_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            yield filename
+
+_UPLOAD_TIMESTAMP_PATTERN = re.compile(r'\d{8}_\d{6}_\d{2,3}')
+
+def parse_upload_timestamp(filename):
+    """从上传文件名解析时间戳，无法识别的文件返回None"""
+    name_without_ext, _ = os.path.splitext(filename)
+    if filename.endswith('.specs'):
+        # 支持格式：timestamp.specs 或 projectname_context_timestamp.specs
+        if '_context_' in name_without_ext:
+            # 处理ISO格式时间戳：2025-07-26_03-46-24-084Z
+            timestamp_part = name_without_ext.split('_context_')[-1]
+            return timestamp_part.replace('-', '').replace('Z', '')
+        return name_without_ext
+    # 时间戳格式的原始文件 (YYYYMMDD_HHMMSS_ms)
+    if _UPLOAD_TIMESTAMP_PATTERN.fullmatch(name_without_ext):
+        return name_without_ext
+    return None
+
+def upload_created_at(timestamp):
+    """由上传时间戳 (UTC的YYYYMMDD_HHMMSS_ms) 得到创建时间，按本地时间表示，无法解析时返回None
+
+    创建时间不能取st_ctime：上传文件是blob的硬链接，同一inode上的任何链接或删除都会改变ctime。
+    """
+    if not _UPLOAD_TIMESTAMP_PATTERN.fullmatch(timestamp):
+        return None
+    try:
+        upload_time = datetime.strptime(timestamp, '%Y%m%d_%H%M%S_%f')
+    except ValueError:
+        return None
+    return datetime.fromtimestamp(upload_time.replace(tzinfo=timezone.utc).timestamp()).isoformat()
+
+_JSON_WHITESPACE = b' \t\r\n'
+_JSON_STRING_SPECIAL = re.compile(rb'["\\]')
+_JSON_STRUCTURAL = re.compile(rb'["{}\[\]]')
+_JSON_SCALAR_END = re.compile(rb'[,}\]\s]')
+
+class SpecsScanner:
+    """增量扫描.specs文件的顶层JSON对象
+
+    只识别字符串和括号结构来跳过不需要的值，不构建Python对象；
+    未被捕获的值读过即丢弃，内存占用与所捕获字段的大小相当。
+    """
+
+    def __init__(self, fp, chunk_size=SPECS_SCAN_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = bytearray()
+        self.base = 0          # buf[0]在文件中的字节偏移
+        self.pos = 0           # 当前扫描位置（相对buf）
+        self.mark = None       # 需要保留的起始位置（相对buf）
+        self.bytes_read = 0
+
+    def _fill(self):
+        keep = self.pos if self.mark is None else self.mark
+        if keep:
+            del self.buf[:keep]
+            self.base += keep
+            self.pos -= keep
+            if self.mark is not None:
+                self.mark -= keep
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf += chunk
+        self.bytes_read += len(chunk)
+        return True
+
+    def _peek(self):
+        while self.pos >= len(self.buf):
+            if not self._fill():
+                raise ValueError('specs文件意外结束')
+        return self.buf[self.pos]
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return
+            if not self._fill():
+                raise ValueError('specs文件意外结束')
+
+    def _expect(self, char):
+        if self._peek() != ord(char):
+            raise ValueError(f'specs文件格式错误: 偏移 {self.base + self.pos} 处应为 {char}')
+        self.pos += 1
+
+    def _skip_string(self):
+        self.pos += 1  # 开头的引号
+        while True:
+            match = _JSON_STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None or (match.group() == b'\\' and match.end() >= len(self.buf)):
+                # 字符串或转义序列跨越了缓冲区边界
+                self.pos = len(self.buf) if match is None else match.start()
+                if not self._fill():
+                    raise ValueError('specs文件意外结束')
+                continue
+            if match.group() == b'\\':
+                self.pos = match.end() + 1
+                continue
+            self.pos = match.end()
+            return
+
+    def _skip_container(self):
+        depth = 0
+        while True:
+            match = _JSON_STRUCTURAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError('specs文件意外结束')
+                continue
+            token = match.group()
+            if token == b'"':
+                self.pos = match.start()
+                self._skip_string()
+                continue
+            depth += 1 if token in (b'{', b'[') else -1
+            self.pos = match.end()
+            if depth == 0:
+                return
+
+    def _skip_scalar(self):
+        while True:
+            match = _JSON_SCALAR_END.search(self.buf, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return
+            self.pos = len(self.buf)
+            if not self._fill():
+                return
+
+    def _skip_value(self):
+        char = self._peek()
+        if char == ord('"'):
+            self._skip_string()
+        elif char in b'{[':
+            self._skip_container()
+        else:
+            self._skip_scalar()
+
+    def members(self, capture=()):
+        """逐个产出顶层成员 (key, start, end, raw)
+
+        start/end为值在文件中的字节偏移；key在capture中（capture为True时捕获全部）时
+        raw为值的原始字节，否则为None。调用方拿到所需字段后即可停止迭代，剩余部分不会被读取。
+        """
+        self._skip_whitespace()
+        if self.base == 0 and self.buf.startswith(b'\xef\xbb\xbf') and self.pos == 0:
+            self.pos = 3
+            self._skip_whitespace()
+        self._expect('{')
+        self._skip_whitespace()
+        if self._peek() == ord('}'):
+            return
+
+        while True:
+            self.mark = self.pos
+            self._skip_string()
+            key = json.loads(bytes(self.buf[self.mark:self.pos]).decode('utf-8'))
+            self.mark = None
+
+            self._skip_whitespace()
+            self._expect(':')
+            self._skip_whitespace()
+
+            start = self.base + self.pos
+            if capture is True or key in capture:
+                self.mark = self.pos
+            self._skip_value()
+            end = self.base + self.pos
+            raw = bytes(self.buf[self.mark:self.pos]) if self.mark is not None else None
+            self.mark = None
+
+            yield key, start, end, raw
+
+            self._skip_whitespace()
+            if self._peek() == ord('}'):
+                return
+            self._expect(',')
+            self._skip_whitespace()
+
+    def array_items(self, start=0, stop=None):
+        """扫描从当前位置开始的JSON数组，返回([start, stop)范围内元素的原始字节, 元素总数)
+
+        范围外的元素只跳过不保留，计算总数仍需扫描到数组末尾。
+        """
+        self._skip_whitespace()
+        self._expect('[')
+        self._skip_whitespace()
+        items = []
+        total = 0
+        if self._peek() == ord(']'):
+            return items, total
+        while True:
+            captured = total >= start and (stop is None or total < stop)
+            if captured:
+                self.mark = self.pos
+            self._skip_value()
+            if captured:
+                items.append(bytes(self.buf[self.mark:self.pos]))
+                self.mark = None
+            total += 1
+            self._skip_whitespace()
+            if self._peek() == ord(']'):
+                return items, total
+            self._expect(',')
+            self._skip_whitespace()
+
+    def finish(self):
+        """members()迭代完成后调用，确认顶层对象之后只剩空白"""
+        self._expect('}')
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                raise ValueError(f'specs文件格式错误: 偏移 {self.base + self.pos} 处有多余内容')
+            if not self._fill():
+                return
+
+specs_scan_stats = {'files': 0, 'bytes_read': 0, 'fallbacks': 0}
+specs_scan_stats_lock = threading.Lock()
+
+def extract_header_fields(metadata):
+    """提取列表所需的metadata字段"""
+    if not isinstance(metadata, dict) or not metadata:
+        return {}
+    return {
+        'name': metadata.get('name'),
+        'task_type': metadata.get('task_type'),
+        'source_file': metadata.get('source_file')
+    }
+
+def load_specs_header(specs_path):
+    """读取.specs文件的metadata字段，文件损坏时返回空字典
+
+    优先流式扫描，解析完metadata后立即停止读取；扫描失败时回退到完整解析。
+    """
+    try:
+        with open(specs_path, 'rb') as specs_file:
+            scanner = SpecsScanner(specs_file)
+            metadata = None
+            try:
+                for key, _, _, raw in scanner.members(capture=('metadata',)):
+                    if key == 'metadata':
+                        metadata = json.loads(raw)
+                        break
+            finally:
+                with specs_scan_stats_lock:
+                    specs_scan_stats['files'] += 1
+                    specs_scan_stats['bytes_read'] += scanner.bytes_read
+            return extract_header_fields(metadata)
+    except ValueError:
+        pass
+    except IOError:
+        return {}
+
+    # 回退：完整解析整个文件
+    with specs_scan_stats_lock:
+        specs_scan_stats['fallbacks'] += 1
+    try:
+        with open(specs_path, 'r', encoding='utf-8') as specs_file:
+            specs_content = json.load(specs_file)
+            # 安全访问可选的metadata字段
+            if specs_content and 'metadata' in specs_content:
+                return extract_header_fields(specs_content['metadata'])
+    except (json.JSONDecodeError, IOError, TypeError):
+        # 如果.specs文件损坏，使用默认元数据
+        pass
+    return {}
+
+def read_specs_metadata(specs_path, defaults):
+    """从.specs文件中读取metadata，文件损坏时返回默认值
+
+    解析结果按(路径, mtime, size)缓存，文件未变化时只需一次stat
+    """
+    try:
+        file_stat = os.stat(specs_path)
+    except OSError:
+        return dict(defaults)
+
+    cache_key = (specs_path, file_stat.st_mtime_ns, file_stat.st_size)
+    header = specs_metadata_cache.get(cache_key)
+    if header is None:
+        header = load_specs_header(specs_path)
+        specs_metadata_cache.set(cache_key, header)
+
+    file_metadata = dict(defaults)
+    file_metadata.update({
+        'name': header.get('name') or file_metadata['name'],
+        'task_type': header.get('task_type') or file_metadata['task_type'],
+        'source_file': header.get('source_file') or file_metadata['source_file']
+    })
+    return file_metadata
+
+# 已知顶层字段的类型约束，未列出的字段不做限制
+SPECS_SECTION_TYPES = {
+    'version': (str, '字符串'),
+    'metadata': (dict, 'JSON对象'),
+    'instructions': (dict, 'JSON对象'),
+    'receiver_instructions': (dict, 'JSON对象'),
+    'assets': (dict, 'JSON对象'),
+    'examples': (list, '数组'),
+    'history': (list, '数组'),
+    'compressed_context': (dict, 'JSON对象'),
+    'chat_compression': (dict, 'JSON对象'),
+    'raw_api_response': (str, '字符串')
+}
+
+class IngestReader:
+    """包装上传流：读取的同时写入暂存文件并计算sha256，供扫描器单遍消费
+
+    设置limit时，读取的字节数超过limit即抛出RequestEntityTooLarge。
+    """
+
+    def __init__(self, source, out=None, limit=None):
+        self.source = source
+        self.out = out
+        self.limit = limit
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        if chunk:
+            self.digest.update(chunk)
+            self.size += len(chunk)
+            if self.limit is not None and self.size > self.limit:
+                raise RequestEntityTooLarge()
+            if self.out is not None:
+                self.out.write(chunk)
+        return chunk
+
+    def drain(self):
+        """读完剩余内容（扫描失败或非specs文件时仍需完整落盘和计算哈希）"""
+        while self.read(64 * 1024):
+            pass
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def scan_specs(fp):
+    """单遍扫描.specs内容：校验JSON语法和顶层字段类型，提取metadata和各顶层字段的字节区间
+
+    返回{'header': 列表所需的metadata字段, 'sections': {字段: [start, end]}}，
+    格式错误时抛出ValueError。每个顶层字段解析后即丢弃，内存占用与最大的字段相当。
+    """
+    scanner = SpecsScanner(fp)
+    metadata = None
+    sections = {}
+    try:
+        for key, start, end, raw in scanner.members(capture=True):
+            try:
+                value = json.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise ValueError(f'specs文件格式错误: {key}不是合法的JSON')
+            expected = SPECS_SECTION_TYPES.get(key)
+            if expected and not isinstance(value, expected[0]):
+                raise ValueError(f'specs文件格式错误: {key}必须是{expected[1]}')
+            if key == 'metadata':
+                metadata = value
+            sections[key] = [start, end]
+        scanner.finish()
+    except UnicodeDecodeError:
+        raise ValueError('specs文件格式错误')
+    finally:
+        with specs_scan_stats_lock:
+            specs_scan_stats['files'] += 1
+            specs_scan_stats['bytes_read'] += scanner.bytes_read
+    return {'header': extract_header_fields(metadata), 'sections': sections}
+
+def scan_specs_file(specs_path):
+    """单遍扫描磁盘上的.specs文件，返回(扫描结果, 内容哈希)，格式错误时抛出ValueError"""
+    with open(specs_path, 'rb') as specs_file:
+        reader = IngestReader(specs_file)
+        specs_index = scan_specs(reader)
+        reader.drain()
+    return specs_index, reader.hexdigest()
+
+def copy_byte_range(src, dst, start, end):
+    """把src中[start, end)的字节分块写入dst"""
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(SPECS_SCAN_CHUNK_SIZE * 4, remaining))
+        if not chunk:
+            raise ValueError('specs文件在扫描后被截断')
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+class HashingWriter:
+    """包装输出文件：写入的同时计算sha256并记录偏移"""
+
+    def __init__(self, out):
+        self.out = out
+        self.digest = hashlib.sha256()
+        self.offset = 0
+
+    def write(self, data):
+        self.out.write(data)
+        self.digest.update(data)
+        self.offset += len(data)
+
+def split_specs_file(src_path, dst_path, specs_index):
+    """把SPLIT_SECTIONS中的顶层字段从specs拆出，返回(主文档的扫描结果, 主文档哈希)
+
+    主文档按扫描得到的字段区间逐段拷贝到dst_path，各字段的值原样保留；拆出的字段值
+    写入dst_path加对应后缀的side文件。重复出现的字段只保留最后一次，与JSON解析结果一致。
+    """
+    sections = {}
+    split = []
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        writer = HashingWriter(dst)
+        writer.write(b'{')
+        for key, (start, end) in specs_index['sections'].items():
+            if key in SPLIT_SECTIONS:
+                with open(dst_path + SPLIT_SECTIONS[key], 'wb') as side:
+                    copy_byte_range(src, side, start, end)
+                    side.flush()
+                    os.fsync(side.fileno())
+                split.append(key)
+                continue
+            prefix = b',' if sections else b''
+            writer.write(prefix + json.dumps(key, ensure_ascii=False).encode('utf-8') + b':')
+            value_start = writer.offset
+            copy_byte_range(src, writer, start, end)
+            sections[key] = [value_start, writer.offset]
+        writer.write(b'}')
+        dst.flush()
+        os.fsync(dst.fileno())
+    return {'header': specs_index['header'], 'sections': sections, 'split': split}, writer.digest.hexdigest()
+
+def has_split_sections(specs_index):
+    """判断扫描结果中是否含有需要拆出的字段"""
+    return bool(specs_index['sections']) and any(key in specs_index['sections'] for key in SPLIT_SECTIONS)
+
+def blob_split_sections(blob_path):
+    """返回blob已拆出的字段（side文件存在的字段）"""
+    return [key for key, suffix in SPLIT_SECTIONS.items() if os.path.exists(blob_path + suffix)]
+
+def blob_side_paths(content_hash, split_sections):
+    """返回拆出字段对应的side文件路径"""
+    blob_path = os.path.join(BLOB_FOLDER, content_hash[:2], content_hash)
+    return {key: blob_path + SPLIT_SECTIONS[key] for key in split_sections if key in SPLIT_SECTIONS}
+
+def discard_staged(staging_path):
+    """删除暂存文件及拆分时写出的side文件"""
+    for path in [staging_path] + [staging_path + suffix for suffix in SPLIT_SECTIONS.values()]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def staged_size(staging_path):
+    """暂存内容占用的字节数：主文档加拆分时写出的side文件"""
+    return sum(
+        os.path.getsize(path)
+        for path in [staging_path] + [staging_path + suffix for suffix in SPLIT_SECTIONS.values()]
+        if os.path.exists(path)
+    )
+
+def blob_stored_size(content_hash, file_size, split_sections):
+    """上传内容在blob存储中占用的字节数：主文档加拆出字段的side文件，用于存储用量计数"""
+    return file_size + sum(
+        os.path.getsize(side_path)
+        for side_path in blob_side_paths(content_hash, split_sections or []).values()
+        if os.path.exists(side_path)
+    )
+
+def build_catalog_entry(user_uuid, filename, content_hash=None, specs_index=None):
+    """根据磁盘上的文件构建uploads索引记录，非上传文件返回None
+
+    上传时传入ingest阶段已得到的content_hash和specs_index；未传入时读取文件计算，
+    .specs文件扫描和哈希在同一遍读取中完成。
+    """
+    file_path = get_upload_path(user_uuid, filename)
+    if not os.path.isfile(file_path):
+        return None
+
+    timestamp = parse_upload_timestamp(filename)
+    if not timestamp:
+        return None
+
+    file_stat = os.stat(file_path)
+
+    sections = None
+    split_sections = None
+    if filename.endswith('.specs'):
+        specs_filename = filename
+        original_name = None
+        if specs_index is None:
+            try:
+                specs_index, content_hash = scan_specs_file(file_path)
+                specs_index['split'] = blob_split_sections(
+                    os.path.join(BLOB_FOLDER, content_hash[:2], content_hash)
+                )
+            except ValueError as e:
+                # 升级前保存的损坏文件仍然建立索引，使用默认元数据
+                app.logger.warning(f"specs文件 {filename} 扫描失败: {str(e)}")
+                specs_index = {'header': {}, 'sections': None}
+        header = specs_index['header']
+        sections = specs_index['sections']
+        split_sections = specs_index.get('split')
+        file_metadata = {
+            'name': header.get('name') or f"上传文件: {filename}",
+            'task_type': header.get('task_type') or 'general_chat',
+            'source_file': header.get('source_file') or filename
+        }
+    else:
+        # 检查是否存在对应的.specs文件
+        specs_filename = f"{timestamp}.specs"
+        specs_path = get_upload_path(user_uuid, specs_filename)
+        original_name = filename
+        defaults = {
+            'name': f"上传文件: {filename}",
+            'task_type': 'document_analysis',
+            'source_file': filename
+        }
+        if os.path.exists(specs_path):
+            file_metadata = read_specs_metadata(specs_path, defaults)
+        else:
+            file_metadata = defaults
+            specs_filename = None
+
+    content_hash = content_hash or compute_file_etag(file_path)
+    stored_size = blob_stored_size(content_hash, file_stat.st_size, split_sections)
+    return {
+        'user_uuid': user_uuid,
+        'timestamp': timestamp,
+        'saved_name': filename,
+        'original_name': original_name or file_metadata['source_file'],
+        'specs_file': specs_filename,
+        # size为上传内容的大小；拆分过的.specs未传入原始大小时（重建索引）以主文档加side文件的大小近似
+        'size': (specs_index or {}).get('source_size', stored_size),
+        'stored_size': stored_size,
+        'task_type': file_metadata['task_type'],
+        'name': file_metadata['name'],
+        'source_file': file_metadata['source_file'],
+        'content_hash': content_hash,
+        'sections': json.dumps(sections) if sections is not None else None,
+        'split_sections': json.dumps(split_sections) if split_sections else None,
+        'created_at': (
+            upload_created_at(timestamp) or datetime.fromtimestamp(file_stat.st_ctime).isoformat()
+        ),
+        'modified_at': datetime.fromtimestamp(file_stat.st_mtime).isoformat()
+    }
+
+def is_precompressed_sidecar(filename):
+    """判断文件是否为预压缩副本"""
+    return filename.endswith(tuple(PRECOMPRESSED_SUFFIXES.values()))
+
+def is_precompressible(size):
+    """文件大小是否在生成预压缩副本的范围内"""
+    return PRECOMPRESS_MIN_SIZE <= size <= PRECOMPRESS_MAX_SIZE
+
+def write_compressed_sidecars(file_path):
+    """为上传文件流式生成gzip/brotli预压缩副本，返回生成的编码列表"""
+    size = os.path.getsize(file_path)
+    if not is_precompressible(size):
+        return []
+
+    written = []
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        if encoding == 'br' and brotli is None:
+            continue
+        sidecar_path = file_path + suffix
+        tmp_path = sidecar_path + '.tmp'
+        with open(file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if encoding == 'gzip':
+                # filename置空，不在gzip头部写入临时文件名
+                with gzip.GzipFile(filename='', mode='wb', fileobj=dst, compresslevel=9, mtime=0) as out:
+                    for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                        out.write(chunk)
+            else:
+                compressor = brotli.Compressor(quality=PRECOMPRESS_BROTLI_QUALITY)
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    dst.write(compressor.process(chunk))
+                dst.write(compressor.finish())
+        if os.path.getsize(tmp_path) > size * PRECOMPRESS_MAX_RATIO:
+            os.remove(tmp_path)
+            continue
+        os.replace(tmp_path, sidecar_path)
+        written.append(encoding)
+    return written
+
+def select_precompressed(file_path):
+    """按Accept-Encoding选择预压缩副本，返回(文件路径, 编码)，无可用副本时编码为None"""
+    available = [
+        encoding for encoding, suffix in PRECOMPRESSED_SUFFIXES.items()
+        if os.path.isfile(file_path + suffix)
+    ]
+    if available:
+        encoding = request.accept_encodings.best_match(available)
+        if encoding:
+            return file_path + PRECOMPRESSED_SUFFIXES[encoding], encoding
+    return file_path, None
+
+def sha256_file(file_path):
+    """流式计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_file_etag(file_path):
+    """计算文件内容的sha256作为强ETag，按(路径, mtime, size)缓存"""
+    file_stat = os.stat(file_path)
+    cache_key = (file_path, file_stat.st_mtime_ns, file_stat.st_size)
+    etag = file_etag_cache.get(cache_key)
+    if etag is None:
+        etag = sha256_file(file_path)
+        file_etag_cache.set(cache_key, etag)
+    return etag
+
+def remember_file_etag(file_path, content_hash):
+    """上传时已算出内容哈希，预先写入ETag缓存避免首次读取时重新计算"""
+    file_stat = os.stat(file_path)
+    file_etag_cache.set((file_path, file_stat.st_mtime_ns, file_stat.st_size), content_hash)
+
+def get_catalog_version(conn):
+    """获取uploads索引版本号，每次索引变化时递增"""
+    row = conn.execute("SELECT value FROM metadata WHERE key = 'catalog_version'").fetchone()
+    return int(row[0]) if row else 0
+
+def bump_catalog_version(conn):
+    """递增uploads索引版本号，使列表接口的ETag失效"""
+    conn.execute('''
+        INSERT INTO metadata (key, value, updated_at)
+        VALUES ('catalog_version', '1', CURRENT_TIMESTAMP)
+        ON CONFLICT(key) DO UPDATE SET
+            value = CAST(CAST(value AS INTEGER) + 1 AS TEXT),
+            updated_at = CURRENT_TIMESTAMP
+    ''')
+
+def catalog_etag(version, scope):
+    """根据索引版本、列表范围和查询参数生成列表ETag"""
+    digest = hashlib.sha256(f"{scope}|{request.query_string.decode('utf-8', 'replace')}".encode('utf-8'))
+    return f"catalog-{version}-{digest.hexdigest()[:16]}"
+
+def not_modified_response(etag):
+    """返回304响应"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+def catalog_upsert(conn, entry):
+    """写入或更新一条uploads索引记录"""
+    conn.execute('''
+        INSERT INTO uploads (
+            user_uuid, timestamp, saved_name, original_name, specs_file, size, stored_size,
+            task_type, name, source_file, content_hash, sections, split_sections, created_at, modified_at
+        )
+        VALUES (:user_uuid, :timestamp, :saved_name, :original_name, :specs_file, :size, :stored_size,
+                :task_type, :name, :source_file, :content_hash, :sections, :split_sections,
+                :created_at, :modified_at)
+        ON CONFLICT(user_uuid, timestamp) DO UPDATE SET
+            saved_name = excluded.saved_name,
+            original_name = excluded.original_name,
+            specs_file = excluded.specs_file,
+            size = excluded.size,
+            stored_size = excluded.stored_size,
+            task_type = excluded.task_type,
+            name = excluded.name,
+            source_file = excluded.source_file,
+            content_hash = excluded.content_hash,
+            sections = excluded.sections,
+            split_sections = excluded.split_sections,
+            modified_at = excluded.modified_at
+    ''', entry)
+
+def catalog_insert(conn, entry):
+    """写入一条新上传的uploads索引记录，时间戳已被占用时抛出sqlite3.IntegrityError，不覆盖已有记录"""
+    conn.execute('''
+        INSERT INTO uploads (
+            user_uuid, timestamp, saved_name, original_name, specs_file, size, stored_size,
+            task_type, name, source_file, content_hash, sections, split_sections, created_at, modified_at
+        )
+        VALUES (:user_uuid, :timestamp, :saved_name, :original_name, :specs_file, :size, :stored_size,
+                :task_type, :name, :source_file, :content_hash, :sections, :split_sections,
+                :created_at, :modified_at)
+    ''', entry)
+
+def blob_acquire(conn, content_hash, size):
+    """新增一个指向blob的引用"""
+    conn.execute('''
+        INSERT INTO blobs (hash, size, refcount) VALUES (?, ?, 1)
+        ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1
+    ''', (content_hash, size))
+
+def storage_add(conn, user_uuid, size_delta, files_delta):
+    """在调用方的事务中增减用户的存储用量计数"""
+    conn.execute('''
+        INSERT INTO user_storage (user_uuid, bytes, files, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_uuid) DO UPDATE SET
+            bytes = bytes + excluded.bytes,
+            files = files + excluded.files,
+            updated_at = excluded.updated_at
+    ''', (user_uuid, size_delta, files_delta, time.time()))
+
+def get_storage_usage(user_uuid):
+    """返回用户的存储用量计数{'bytes', 'files'}"""
+    with get_db() as conn:
+        row = conn.execute('SELECT bytes, files FROM user_storage WHERE user_uuid = ?', (user_uuid,)).fetchone()
+    return {'bytes': row['bytes'], 'files': row['files']} if row else {'bytes': 0, 'files': 0}
+
+def storage_quota_error(user_uuid, add_bytes, add_files=1, usage=None):
+    """按用量计数检查新增内容是否超出配额，超出时返回错误信息，否则返回None"""
+    if not USER_QUOTA_BYTES and not USER_QUOTA_FILES:
+        return None
+    if usage is None:
+        usage = get_storage_usage(user_uuid)
+    if USER_QUOTA_BYTES and usage['bytes'] + add_bytes > USER_QUOTA_BYTES:
+        return f"存储空间不足: 已使用 {usage['bytes']} 字节，配额 {USER_QUOTA_BYTES} 字节"
+    if USER_QUOTA_FILES and usage['files'] + add_files > USER_QUOTA_FILES:
+        return f"文件数量超出配额: 已有 {usage['files']} 个文件，配额 {USER_QUOTA_FILES} 个"
+    return None
+
+def quota_exceeded_response(message):
+    """超出存储配额时的响应"""
+    return jsonify({
+        'error': message,
+        'quota': {'bytes': USER_QUOTA_BYTES or None, 'files': USER_QUOTA_FILES or None}
+    }), 413
+
+def reconcile_user_storage():
+    """按uploads索引重新计算所有用户的存储用量并修正偏差，返回计数有偏差的用户数"""
+    with get_db() as conn:
+        # 读取和修正在同一个写事务中完成，期间的上传和删除会等待提交
+        conn.execute('BEGIN IMMEDIATE')
+        actual = {row['user_uuid']: (row['bytes'], row['files']) for row in conn.execute(
+            'SELECT user_uuid, SUM(stored_size) AS bytes, COUNT(*) AS files FROM uploads GROUP BY user_uuid'
+        ).fetchall()}
+        recorded = {row['user_uuid']: (row['bytes'], row['files']) for row in conn.execute(
+            'SELECT user_uuid, bytes, files FROM user_storage'
+        ).fetchall()}
+        drifted = [
+            user_uuid for user_uuid in actual.keys() | recorded.keys()
+            if actual.get(user_uuid, (0, 0)) != recorded.get(user_uuid, (0, 0))
+        ]
+        now = time.time()
+        conn.executemany('''
+            INSERT INTO user_storage (user_uuid, bytes, files, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_uuid) DO UPDATE SET
+                bytes = excluded.bytes,
+                files = excluded.files,
+                updated_at = excluded.updated_at
+        ''', [(user_uuid, *actual.get(user_uuid, (0, 0)), now) for user_uuid in drifted])
+        conn.commit()
+    if drifted:
+        app.logger.warning(f"已修正 {len(drifted)} 个用户的存储用量计数")
+    return len(drifted)
+
+def blob_release(conn, content_hashes):
+    """释放引用，返回引用计数归零的blob哈希列表"""
+    conn.executemany(
+        'UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?',
+        [(content_hash,) for content_hash in content_hashes]
+    )
+    placeholders = ', '.join('?' for _ in content_hashes)
+    if not placeholders:
+        return []
+    return [row['hash'] for row in conn.execute(
+        f'SELECT hash FROM blobs WHERE refcount <= 0 AND hash IN ({placeholders})',
+        list(content_hashes)
+    ).fetchall()]
+
+def remove_unreferenced_blobs(content_hashes):
+    """删除引用计数已归零的blob记录及文件（含预压缩副本和拆出的字段），返回删除数量"""
+    removed = 0
+    for content_hash in content_hashes:
+        with get_db() as conn:
+            cursor = conn.execute('DELETE FROM blobs WHERE hash = ? AND refcount <= 0', (content_hash,))
+            if cursor.rowcount:
+                conn.execute('DELETE FROM blob_aliases WHERE blob_hash = ?', (content_hash,))
+            conn.commit()
+        if cursor.rowcount == 0:
+            continue
+        blob_path = os.path.join(BLOB_FOLDER, content_hash[:2], content_hash)
+        suffixes = list(PRECOMPRESSED_SUFFIXES.values()) + list(SPLIT_SECTIONS.values())
+        for path in [blob_path] + [blob_path + suffix for suffix in suffixes]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+def user_owns_content(user_uuid, content_hash):
+    """用户自己的上传中是否已有该内容，content_hash可以是主文档哈希或原始上传哈希"""
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT 1 FROM uploads WHERE user_uuid = ? AND content_hash = ? LIMIT 1',
+            (user_uuid, resolve_blob_hash(content_hash))
+        ).fetchone()
+    return row is not None
+
+def resolve_blob_hash(content_hash):
+    """把上传内容的原始哈希解析为blob哈希：拆分过字段的specs以主文档哈希寻址"""
+    with get_db() as conn:
+        row = conn.execute('SELECT blob_hash FROM blob_aliases WHERE hash = ?', (content_hash,)).fetchone()
+    return row['blob_hash'] if row else content_hash
+
+def link_blob(blob_path, file_path):
+    """在用户目录中创建指向blob及其预压缩副本的硬链接"""
+    os.link(blob_path, file_path)
+    for suffix in PRECOMPRESSED_SUFFIXES.values():
+        if os.path.exists(blob_path + suffix):
+            os.link(blob_path + suffix, file_path + suffix)
+
+def catalog_row_to_file_info(row):
+    """将uploads索引记录转换为列表接口返回的文件信息"""
+    return {
+        'timestamp': row['timestamp'],
+        'original_name': row['original_name'],
+        'saved_name': row['saved_name'],
+        'size': row['size'],
+        'created_at': row['created_at'],
+        'modified_at': row['modified_at'],
+        'name': row['name'],
+        'task_type': row['task_type'],
+        'source_file': row['source_file'],
+        'specs_file': row['specs_file'],
+        'content_hash': row['content_hash'],
+        'access_url': f"/api/{row['user_uuid']}/{row['timestamp']}.html"
+    }
+
+def encode_page_cursor(row):
+    """将(created_at, id)编码为不透明的分页游标"""
+    raw = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_page_cursor(cursor):
+    """解析分页游标，格式无效时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError('无效的分页游标')
+    return created_at, row_id
+
+def parse_page_args(args):
+    """解析limit/after分页参数，返回(limit, after)"""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('无效的limit参数')
+    if limit < 1:
+        raise ValueError('无效的limit参数')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    after = args.get('after')
+    return limit, decode_page_cursor(after) if after else None
+
+def query_catalog_page(conn, limit, after=None, user_uuid=None):
+    """按(created_at, id)倒序分页查询uploads索引，返回(rows, next_cursor)"""
+    clauses = []
+    params = []
+    if user_uuid:
+        clauses.append('user_uuid = ?')
+        params.append(user_uuid)
+    if after:
+        clauses.append('(created_at, id) < (?, ?)')
+        params.extend(after)
+
+    sql = 'SELECT * FROM uploads'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1])
+    return rows, next_cursor
+
+def reindex_uploads(user_uuid=None):
+    """扫描上传目录重建uploads索引，返回索引的文件数"""
+    if user_uuid:
+        user_uuids = [user_uuid]
+    elif os.path.exists(UPLOAD_FOLDER):
+        user_uuids = [
+            name for name in os.listdir(UPLOAD_FOLDER)
+            if not name.startswith('.') and os.path.isdir(os.path.join(UPLOAD_FOLDER, name))
+        ]
+    else:
+        user_uuids = []
+
+    indexed = 0
+    with get_db() as conn:
+        # 文件名中没有上传时间的旧文件沿用已记录的创建时间，避免重建后列表顺序变化；
+        # 拆分过的.specs磁盘上只有主文档，沿用已记录的上传大小
+        sql = 'SELECT user_uuid, timestamp, created_at, size FROM uploads'
+        params = ()
+        if user_uuid:
+            sql += ' WHERE user_uuid = ?'
+            params = (user_uuid,)
+        recorded = {
+            (row['user_uuid'], row['timestamp']): row for row in conn.execute(sql, params).fetchall()
+        }
+
+        if user_uuid:
+            conn.execute('DELETE FROM uploads WHERE user_uuid = ?', (user_uuid,))
+        else:
+            conn.execute('DELETE FROM uploads')
+
+        for current_uuid in user_uuids:
+            processed_files = set()  # 记录已处理的时间戳，避免重复
+            for filename in iter_user_upload_files(current_uuid):
+                try:
+                    entry = build_catalog_entry(current_uuid, filename)
+                except OSError as file_error:
+                    app.logger.warning(f"处理文件 {filename} 时出错: {str(file_error)}")
+                    continue
+                if not entry or entry['timestamp'] in processed_files:
+                    continue
+                processed_files.add(entry['timestamp'])
+                recorded_row = recorded.get((current_uuid, entry['timestamp']))
+                if recorded_row:
+                    if upload_created_at(entry['timestamp']) is None:
+                        entry['created_at'] = recorded_row['created_at']
+                    if entry['split_sections']:
+                        entry['size'] = recorded_row['size']
+                catalog_upsert(conn, entry)
+                indexed += 1
+        # 按重建后的索引重新计算blob引用计数
+        conn.execute('''
+            UPDATE blobs SET refcount = (
+                SELECT COUNT(*) FROM uploads WHERE uploads.content_hash = blobs.hash
+            )
+        ''')
+        bump_catalog_version(conn)
+        conn.commit()
+    reconcile_user_storage()
+    return indexed
 
 def get_db_version():
     """获取数据库schema版本"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT value FROM metadata WHERE key = 'schema_version'")
             result = cursor.fetchone()
@@ -74,50 +1624,449 @@ def get_db_version():
 
 def set_db_version(version):
     """设置数据库schema版本"""
-    with sqlite3.connect(DATABASE) as conn:
+    with get_db() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO metadata (key, value, updated_at)
+            VALUES ('schema_version', ?, CURRENT_TIMESTAMP)
+        ''', (str(version),))
+        conn.commit()
+
+def migrate_to_v1():
+    """迁移到版本1: 添加增强用户字段"""
+    with get_db() as conn:
+        # 创建metadata表用于版本管理
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 安全添加新字段
+        migrations = [
+            "ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE users ADD COLUMN given_name TEXT",
+            "ALTER TABLE users ADD COLUMN family_name TEXT", 
+            "ALTER TABLE users ADD COLUMN locale TEXT DEFAULT 'zh-CN'",
+            "ALTER TABLE users ADD COLUMN sub_id TEXT",
+            "ALTER TABLE users ADD COLUMN profile_link TEXT",
+            "ALTER TABLE users ADD COLUMN gender TEXT",
+            "ALTER TABLE users ADD COLUMN hosted_domain TEXT",
+            "ALTER TABLE users ADD COLUMN oauth_response_raw TEXT",
+            "ALTER TABLE users ADD COLUMN last_profile_sync DATETIME"
+        ]
+        
+        for migration in migrations:
+            try:
+                conn.execute(migration)
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise e  # 重新抛出非重复列名错误
+        
+        # 为现有用户设置默认值
+        conn.execute("UPDATE users SET last_profile_sync = updated_at WHERE last_profile_sync IS NULL")
+        conn.commit()
+
+def migrate_to_v2():
+    """迁移到版本2: 添加uploads文件索引表，返回True表示需要从磁盘回填"""
+    with get_db() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_uuid TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                saved_name TEXT NOT NULL,
+                original_name TEXT,
+                specs_file TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                task_type TEXT,
+                name TEXT,
+                source_file TEXT,
+                created_at TEXT NOT NULL,
+                modified_at TEXT,
+                UNIQUE(user_uuid, timestamp)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_user_created ON uploads(user_uuid, created_at DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_created ON uploads(created_at DESC)')
+        conn.commit()
+    return True
+
+def migrate_to_v3():
+    """迁移到版本3: uploads索引改为(created_at, id)复合索引以支持游标分页"""
+    with get_db() as conn:
+        conn.execute('DROP INDEX IF EXISTS idx_uploads_user_created')
+        conn.execute('DROP INDEX IF EXISTS idx_uploads_created')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_user_page ON uploads(user_uuid, created_at DESC, id DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_page ON uploads(created_at DESC, id DESC)')
+        conn.commit()
+
+def migrate_to_v4():
+    """迁移到版本4: 为会话和用户查询热点补充索引"""
+    with get_db() as conn:
+        # 登录时按user_id清理旧会话
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id)')
+        # 公开列表批量查询用户名时只需读取索引
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_uuid_name ON users(uuid, name)')
+        conn.execute('ANALYZE')
+        conn.commit()
+
+def migrate_to_v5():
+    """迁移到版本5: 添加已注销令牌表"""
+    with get_db() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                jti TEXT PRIMARY KEY,
+                user_id INTEGER,
+                expires_at INTEGER NOT NULL,
+                revoked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at)')
+        conn.commit()
+
+def hash_session_token(token):
+    """会话表只保存令牌的SHA-256摘要"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def migrate_to_v6():
+    """迁移到版本6: user_sessions改存令牌摘要，并启用增量vacuum"""
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT user_id, token, expires_at, ip_address, user_agent, is_active, created_at FROM user_sessions'
+        ).fetchall()
+        conn.execute('DROP TABLE user_sessions')
+        conn.execute('''
+            CREATE TABLE user_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                token_hash TEXT UNIQUE NOT NULL,
+                expires_at DATETIME NOT NULL,
+                ip_address TEXT,
+                user_agent TEXT,
+                is_active BOOLEAN DEFAULT TRUE,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        ''')
+        conn.executemany('''
+            INSERT OR IGNORE INTO user_sessions
+                (user_id, token_hash, expires_at, ip_address, user_agent, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (row['user_id'], hash_session_token(row['token']), row['expires_at'],
+             row['ip_address'], row['user_agent'], row['is_active'], row['created_at'])
+            for row in rows
+        ])
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id)')
+        # 维护任务按过期时间和失效标记分批清理
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions(expires_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_inactive ON user_sessions(id) WHERE is_active = FALSE')
+        conn.commit()
+        # auto_vacuum模式只有在VACUUM后才会对已有数据库生效
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+def migrate_to_v7():
+    """迁移到版本7: 添加断点续传会话表"""
+    with get_db() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id TEXT PRIMARY KEY,
+                user_uuid TEXT NOT NULL,
+                original_name TEXT NOT NULL,
+                total_size INTEGER NOT NULL,
+                received INTEGER NOT NULL DEFAULT 0,
+                expires_at INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions(expires_at)')
+        conn.commit()
+
+def migrate_to_v8():
+    """迁移到版本8: 添加内容寻址blob表和uploads.content_hash"""
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(uploads)').fetchall()]
+        if 'content_hash' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN content_hash TEXT')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads(content_hash)')
+        conn.commit()
+    return True
+
+def migrate_to_v9():
+    """迁移到版本9: uploads记录specs顶层字段的字节区间"""
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(uploads)').fetchall()]
+        if 'sections' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN sections TEXT')
+        conn.commit()
+    return True
+
+def migrate_to_v10():
+    """迁移到版本10: 添加后台任务队列表"""
+    with get_db() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                user_uuid TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_after REAL NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                duration_ms REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, run_after, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_uuid, id DESC)')
+        conn.commit()
+
+def migrate_to_v11():
+    """迁移到版本11: 记录specs拆出的字段，添加原始内容哈希到blob哈希的映射"""
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(uploads)').fetchall()]
+        if 'split_sections' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN split_sections TEXT')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS blob_aliases (
+                hash TEXT PRIMARY KEY,
+                blob_hash TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_blob_aliases_blob ON blob_aliases(blob_hash)')
+        conn.commit()
+
+def migrate_to_v12():
+    """迁移到版本12: 添加用户存储用量计数表，并按现有索引回填"""
+    with get_db() as conn:
         conn.execute('''
-            INSERT OR REPLACE INTO metadata (key, value, updated_at)
-            VALUES ('schema_version', ?, CURRENT_TIMESTAMP)
-        ''', (str(version),))
+            CREATE TABLE IF NOT EXISTS user_storage (
+                user_uuid TEXT PRIMARY KEY,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                files INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            )
+        ''')
+        conn.execute('''
+            INSERT OR REPLACE INTO user_storage (user_uuid, bytes, files, updated_at)
+            SELECT user_uuid, SUM(size), COUNT(*), ? FROM uploads GROUP BY user_uuid
+        ''', (time.time(),))
         conn.commit()
 
-def migrate_to_v1():
-    """迁移到版本1: 添加增强用户字段"""
-    with sqlite3.connect(DATABASE) as conn:
-        # 创建metadata表用于版本管理
+def migrate_to_v13():
+    """迁移到版本13: 添加多进程共享的限流令牌桶表"""
+    with get_db() as conn:
         conn.execute('''
-            CREATE TABLE IF NOT EXISTS metadata (
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
                 key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                tokens REAL NOT NULL,
+                allowed INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated ON rate_limit_buckets(updated_at)')
+        conn.commit()
+
+def migrate_to_v14():
+    """迁移到版本14: revoked_tokens改用AUTOINCREMENT主键
+
+    各进程按id增量同步注销记录。普通rowid在过期记录全部清除后会从1重新分配，
+    其他进程会漏掉新的注销；AUTOINCREMENT保证id单调递增、不被复用。
+    """
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(revoked_tokens)').fetchall()]
+        if 'id' in columns:
+            return
+        conn.execute('''
+            CREATE TABLE revoked_tokens_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                jti TEXT NOT NULL UNIQUE,
+                user_id INTEGER,
+                expires_at INTEGER NOT NULL,
+                revoked_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
-        # 安全添加新字段
-        migrations = [
-            "ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT FALSE",
-            "ALTER TABLE users ADD COLUMN given_name TEXT",
-            "ALTER TABLE users ADD COLUMN family_name TEXT", 
-            "ALTER TABLE users ADD COLUMN locale TEXT DEFAULT 'zh-CN'",
-            "ALTER TABLE users ADD COLUMN sub_id TEXT",
-            "ALTER TABLE users ADD COLUMN profile_link TEXT",
-            "ALTER TABLE users ADD COLUMN gender TEXT",
-            "ALTER TABLE users ADD COLUMN hosted_domain TEXT",
-            "ALTER TABLE users ADD COLUMN oauth_response_raw TEXT",
-            "ALTER TABLE users ADD COLUMN last_profile_sync DATETIME"
-        ]
-        
-        for migration in migrations:
-            try:
-                conn.execute(migration)
-            except sqlite3.OperationalError as e:
-                if "duplicate column name" not in str(e):
-                    raise e  # 重新抛出非重复列名错误
-        
-        # 为现有用户设置默认值
-        conn.execute("UPDATE users SET last_profile_sync = updated_at WHERE last_profile_sync IS NULL")
+        # 保留原有rowid作为id，新记录的id从当前最大值之后开始分配
+        conn.execute('''
+            INSERT INTO revoked_tokens_new (id, jti, user_id, expires_at, revoked_at)
+            SELECT rowid, jti, user_id, expires_at, revoked_at FROM revoked_tokens
+        ''')
+        conn.execute('DROP TABLE revoked_tokens')
+        conn.execute('ALTER TABLE revoked_tokens_new RENAME TO revoked_tokens')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens(expires_at)')
+        conn.commit()
+
+def migrate_to_v15():
+    """迁移到版本15: 后台任务记录心跳时间"""
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)').fetchall()]
+        if 'heartbeat_at' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+        conn.commit()
+
+def migrate_to_v16():
+    """迁移到版本16: uploads记录内容实际占用的字节数（主文档加side文件），存储用量按此重新计算"""
+    with get_db() as conn:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(uploads)').fetchall()]
+        if 'stored_size' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN stored_size INTEGER')
+        conn.execute('UPDATE uploads SET stored_size = size WHERE split_sections IS NULL')
+        rows = conn.execute(
+            'SELECT id, content_hash, size, split_sections FROM uploads WHERE split_sections IS NOT NULL'
+        ).fetchall()
+        conn.executemany('UPDATE uploads SET stored_size = ? WHERE id = ?', [
+            (blob_stored_size(row['content_hash'], row['size'], json.loads(row['split_sections'])), row['id'])
+            for row in rows
+        ])
+        conn.execute('''
+            INSERT OR REPLACE INTO user_storage (user_uuid, bytes, files, updated_at)
+            SELECT user_uuid, SUM(stored_size), COUNT(*), ? FROM uploads GROUP BY user_uuid
+        ''', (time.time(),))
+        conn.commit()
+
+def migrate_to_v17():
+    """迁移到版本17: 拆分过的.specs的size恢复为上传内容的大小
+
+    此前size记录的是拆分后主文档的大小，原始大小已无法得知，按主文档加side文件的大小近似。
+    """
+    with get_db() as conn:
+        conn.execute('UPDATE uploads SET size = stored_size WHERE split_sections IS NOT NULL')
+        conn.commit()
+
+def migrate_to_v18():
+    """迁移到版本18: 为按用户统计未完成的上传会话添加索引"""
+    with get_db() as conn:
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions(user_uuid, expires_at)'
+        )
         conn.commit()
 
+# 按版本顺序执行的迁移列表，新增迁移只需追加到末尾
+MIGRATIONS = [
+    (1, migrate_to_v1),
+    (2, migrate_to_v2),
+    (3, migrate_to_v3),
+    (4, migrate_to_v4),
+    (5, migrate_to_v5),
+    (6, migrate_to_v6),
+    (7, migrate_to_v7),
+    (8, migrate_to_v8),
+    (9, migrate_to_v9),
+    (10, migrate_to_v10),
+    (11, migrate_to_v11),
+    (12, migrate_to_v12),
+    (13, migrate_to_v13),
+    (14, migrate_to_v14),
+    (15, migrate_to_v15),
+    (16, migrate_to_v16),
+    (17, migrate_to_v17),
+    (18, migrate_to_v18),
+]
+
+def run_migrations():
+    """按顺序执行尚未应用的迁移
+
+    迁移返回True表示uploads索引需要从磁盘回填，回填在全部迁移完成后执行一次，
+    保证写入时所有列都已存在。
+    """
+    current_version = get_db_version()
+    needs_reindex = False
+    for version, migration in MIGRATIONS:
+        if current_version >= version:
+            continue
+        print(f"执行数据库迁移到版本{version}...")
+        needs_reindex = bool(migration()) or needs_reindex
+        set_db_version(version)
+        print("数据库迁移完成")
+    
+    if needs_reindex:
+        indexed = reindex_uploads()
+        print(f"已索引 {indexed} 个上传文件")
+
+# 热点查询，query-plan检查要求它们都能走索引
+HOT_QUERIES = [
+    ('用户按ID查询', 'SELECT * FROM users WHERE id = ?', (0,)),
+    ('用户按邮箱查询', 'SELECT * FROM users WHERE email = ?', ('',)),
+    ('用户按OAuth身份查询', 'SELECT * FROM users WHERE provider = ? AND provider_id = ?', ('', '')),
+    ('批量查询用户名', 'SELECT uuid, name FROM users WHERE uuid IN (?, ?)', ('', '')),
+    ('按用户清理会话', 'DELETE FROM user_sessions WHERE user_id = ?', (0,)),
+    ('按令牌注销会话', 'UPDATE user_sessions SET is_active = FALSE WHERE token_hash = ?', ('',)),
+    ('清理过期会话',
+     'DELETE FROM user_sessions WHERE id IN '
+     '(SELECT id FROM user_sessions WHERE expires_at < ? LIMIT ?)', ('', 1)),
+    ('清理失效会话',
+     'DELETE FROM user_sessions WHERE id IN '
+     '(SELECT id FROM user_sessions WHERE is_active = FALSE LIMIT ?)', (1,)),
+    ('查询上传会话', 'SELECT * FROM upload_sessions WHERE id = ? AND user_uuid = ?', ('', '')),
+    ('统计未完成的上传会话',
+     'SELECT COUNT(*) AS sessions, COALESCE(SUM(total_size), 0) AS bytes FROM upload_sessions '
+     'WHERE user_uuid = ? AND expires_at >= ?', ('', 0)),
+    ('清理过期上传会话',
+     'SELECT id FROM upload_sessions WHERE expires_at < ? LIMIT ?', (0, 1)),
+    ('清理过期注销记录',
+     'DELETE FROM revoked_tokens WHERE rowid IN '
+     '(SELECT rowid FROM revoked_tokens WHERE expires_at < ? LIMIT ?)', (0, 1)),
+    ('用户文件列表',
+     'SELECT * FROM uploads WHERE user_uuid = ? ORDER BY created_at DESC, id DESC', ('',)),
+    ('用户文件分页',
+     'SELECT * FROM uploads WHERE user_uuid = ? AND (created_at, id) < (?, ?) '
+     'ORDER BY created_at DESC, id DESC LIMIT ?', ('', '', 0, 1)),
+    ('全局文件首页', 'SELECT * FROM uploads ORDER BY created_at DESC, id DESC LIMIT ?', (1,)),
+    ('全局文件分页',
+     'SELECT * FROM uploads WHERE (created_at, id) < (?, ?) '
+     'ORDER BY created_at DESC, id DESC LIMIT ?', ('', 0, 1)),
+    ('specs内容索引查询',
+     'SELECT content_hash, sections, split_sections FROM uploads '
+     'WHERE user_uuid = ? AND timestamp = ? AND saved_name = ?',
+     ('', '', '')),
+    ('按哈希查询blob', 'SELECT * FROM blobs WHERE hash = ?', ('',)),
+    ('清理空闲限流令牌桶',
+     'DELETE FROM rate_limit_buckets WHERE key IN '
+     '(SELECT key FROM rate_limit_buckets WHERE updated_at < ? LIMIT ?)', (0, 1)),
+    ('查询存储用量', 'SELECT bytes, files FROM user_storage WHERE user_uuid = ?', ('',)),
+    ('解析blob别名', 'SELECT blob_hash FROM blob_aliases WHERE hash = ?', ('',)),
+    ('清理blob别名', 'DELETE FROM blob_aliases WHERE blob_hash = ?', ('',)),
+    ('统计blob引用',
+     'SELECT COUNT(*) FROM uploads WHERE content_hash = ?', ('',)),
+    ('领取后台任务',
+     "SELECT id FROM jobs WHERE status = 'pending' AND run_after <= ? ORDER BY run_after, id LIMIT 1", (0,)),
+    ('用户任务列表', 'SELECT * FROM jobs WHERE user_uuid = ? ORDER BY id DESC LIMIT ?', ('', 1)),
+    ('删除文件索引', 'DELETE FROM uploads WHERE user_uuid = ? AND timestamp = ?', ('', '')),
+    ('按时间戳查询文件',
+     'SELECT saved_name, specs_file, stored_size FROM uploads WHERE user_uuid = ? AND timestamp = ?', ('', '')),
+]
+
+_FULL_SCAN_PATTERN = re.compile(r'^SCAN \S+$|USE TEMP B-TREE')
+
+def check_query_plans():
+    """检查热点查询的执行计划，返回退化为全表扫描或临时排序的查询列表"""
+    problems = []
+    # 使用独立连接，避免连接池中缓存的旧执行计划
+    with closing(sqlite3.connect(DATABASE)) as conn:
+        conn.row_factory = sqlite3.Row
+        for name, sql, params in HOT_QUERIES:
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            details = [row['detail'] for row in plan]
+            if any(_FULL_SCAN_PATTERN.search(detail) for detail in details):
+                problems.append((name, sql, details))
+    return problems
+
 def init_db():
     """初始化数据库并执行迁移"""
     # 确保数据库目录存在
@@ -125,7 +2074,7 @@ def init_db():
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir, exist_ok=True)
     
-    with sqlite3.connect(DATABASE) as conn:
+    with get_db() as conn:
         # 创建基础表结构
         conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -159,19 +2108,649 @@ def init_db():
         conn.commit()
     
     # 执行数据库迁移
-    current_version = get_db_version()
-    if current_version < 1:
-        print("执行数据库迁移到版本1...")
-        migrate_to_v1()
-        set_db_version(1)
-        print("数据库迁移完成")
+    run_migrations()
+    
+    # 加载已注销令牌
+    revocation_index.load()
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """检查热点查询是否走索引，存在全表扫描时以非零状态退出"""
+    init_db()
+    problems = check_query_plans()
+    for name, sql, details in problems:
+        print(f"[全表扫描] {name}: {sql}")
+        for detail in details:
+            print(f"    {detail}")
+    if problems:
+        sys.exit(1)
+    print(f"{len(HOT_QUERIES)} 个热点查询均使用索引")
+
+@app.cli.command('reindex-uploads')
+def reindex_uploads_command():
+    """从磁盘重建uploads文件索引"""
+    init_db()
+    indexed = reindex_uploads()
+    print(f"已索引 {indexed} 个上传文件")
+
+@app.cli.command('precompress-uploads')
+def precompress_uploads_command():
+    """为已有的上传文件补齐预压缩副本"""
+    created = 0
+    for user_uuid in os.listdir(UPLOAD_FOLDER):
+        if user_uuid.startswith('.') or not os.path.isdir(os.path.join(UPLOAD_FOLDER, user_uuid)):
+            continue
+        for filename in iter_user_upload_files(user_uuid):
+            if is_precompressed_sidecar(filename) or not parse_upload_timestamp(filename):
+                continue
+            file_path = get_upload_path(user_uuid, filename)
+            if all(os.path.exists(file_path + suffix) for suffix in PRECOMPRESSED_SUFFIXES.values()):
+                continue
+            created += len(write_compressed_sidecars(file_path))
+    print(f"已生成 {created} 个预压缩副本")
+
+def delete_in_batches(sql, params, batch_size=MAINTENANCE_BATCH_SIZE):
+    """分批执行带LIMIT的删除语句，每批单独提交以缩短写锁持有时间，返回删除总行数"""
+    deleted = 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.execute(sql, params + (batch_size,))
+            conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+maintenance_stats = {
+    'runs': 0,
+    'last_run_at': None,
+    'last_duration_ms': None,
+    'last_result': None,
+    'total_rows_reclaimed': 0
+}
+
+def run_maintenance():
+    """清理过期或已失效的会话和注销记录，回收空闲页并更新统计信息"""
+    started = time.monotonic()
+    now = datetime.utcnow()
+    
+    expired_sessions = delete_in_batches(
+        'DELETE FROM user_sessions WHERE id IN '
+        '(SELECT id FROM user_sessions WHERE expires_at < ? LIMIT ?)',
+        (now,)
+    )
+    inactive_sessions = delete_in_batches(
+        'DELETE FROM user_sessions WHERE id IN '
+        '(SELECT id FROM user_sessions WHERE is_active = FALSE LIMIT ?)',
+        ()
+    )
+    revoked_tokens = delete_in_batches(
+        'DELETE FROM revoked_tokens WHERE rowid IN '
+        '(SELECT rowid FROM revoked_tokens WHERE expires_at < ? LIMIT ?)',
+        (int(time.time()),)
+    )
+    revocation_index.purge_expired()
+    upload_sessions = expire_upload_sessions()
+    stale_jobs = requeue_stale_jobs()
+    finished_jobs = delete_in_batches(
+        "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') "
+        "AND finished_at < ? LIMIT ?)",
+        (time.time() - JOB_RETENTION,)
+    )
+    with get_db() as conn:
+        orphan_blobs = [row['hash'] for row in conn.execute(
+            'SELECT hash FROM blobs WHERE refcount <= 0'
+        ).fetchall()]
+    with blob_lock:
+        orphan_blobs = remove_unreferenced_blobs(orphan_blobs)
+    storage_drift = reconcile_user_storage()
+    rate_limit_buckets = rate_limiter.purge_idle()
+    
+    with get_db() as conn:
+        freelist_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})').fetchall()
+        freelist_after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if expired_sessions or inactive_sessions or revoked_tokens:
+            conn.execute('ANALYZE user_sessions')
+            conn.execute('ANALYZE revoked_tokens')
+        conn.execute('PRAGMA optimize')
+    
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+    result = {
+        'expired_sessions': expired_sessions,
+        'inactive_sessions': inactive_sessions,
+        'revoked_tokens': revoked_tokens,
+        'upload_sessions': upload_sessions,
+        'orphan_blobs': orphan_blobs,
+        'stale_jobs': stale_jobs,
+        'finished_jobs': finished_jobs,
+        'storage_drift': storage_drift,
+        'rate_limit_buckets': rate_limit_buckets,
+        'pages_freed': freelist_before - freelist_after
+    }
+    maintenance_stats['runs'] += 1
+    maintenance_stats['last_run_at'] = now.isoformat()
+    maintenance_stats['last_duration_ms'] = duration_ms
+    maintenance_stats['last_result'] = result
+    maintenance_stats['total_rows_reclaimed'] += (
+        expired_sessions + inactive_sessions + revoked_tokens + upload_sessions + finished_jobs
+    )
+    app.logger.info(f"数据库维护完成，耗时 {duration_ms}ms: {result}")
+    return result
+
+def expire_upload_sessions(batch_size=MAINTENANCE_BATCH_SIZE):
+    """删除过期未完成的断点续传会话及其暂存文件，返回删除数量"""
+    expired = 0
+    while True:
+        with get_db() as conn:
+            session_ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM upload_sessions WHERE expires_at < ? LIMIT ?',
+                (int(time.time()), batch_size)
+            ).fetchall()]
+            conn.executemany('DELETE FROM upload_sessions WHERE id = ?', [(sid,) for sid in session_ids])
+            conn.commit()
+        for session_id in session_ids:
+            try:
+                os.remove(get_staging_path(session_id))
+            except FileNotFoundError:
+                pass
+        expired += len(session_ids)
+        if len(session_ids) < batch_size:
+            return expired
+
+class MaintenanceWorker:
+    """按MAINTENANCE_INTERVAL周期执行run_maintenance的后台线程"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                run_maintenance()
+            except Exception as e:
+                app.logger.error(f"数据库维护失败: {str(e)}")
+
+maintenance_worker = MaintenanceWorker(MAINTENANCE_INTERVAL)
+
+# 任务类型 -> 处理函数，处理函数抛出异常时按退避时间重试
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """注册后台任务处理函数"""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+def enqueue_job(conn, kind, payload, user_uuid=None):
+    """在调用方的事务中写入一个待执行任务，返回任务ID；提交后调用job_pool.notify()唤醒工作线程"""
+    now = time.time()
+    cursor = conn.execute('''
+        INSERT INTO jobs (kind, payload, user_uuid, max_attempts, run_after, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (kind, json.dumps(payload), user_uuid, JOB_MAX_ATTEMPTS, now, now))
+    return cursor.lastrowid
+
+def claim_job():
+    """原子地领取一个到期的待执行任务，没有任务时返回None"""
+    now = time.time()
+    with get_db() as conn:
+        row = conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, heartbeat_at = ?
+            WHERE id = (
+                SELECT id FROM jobs WHERE status = 'pending' AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1
+            )
+            RETURNING *
+        ''', (now, now, now)).fetchone()
+        conn.commit()
+    return row
+
+@contextmanager
+def job_heartbeat(job_id):
+    """任务执行期间每隔JOB_HEARTBEAT_INTERVAL更新heartbeat_at，表明所在进程仍在运行"""
+    stop = threading.Event()
+    
+    def beat():
+        while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with get_db() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                        (time.time(), job_id)
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                app.logger.warning(f"更新后台任务 {job_id} 心跳失败: {str(e)}")
+    
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def run_job(job):
+    """执行一个已领取的任务并记录结果和耗时，返回是否成功"""
+    started = time.monotonic()
+    try:
+        handler = JOB_HANDLERS.get(job['kind'])
+        if handler is None:
+            raise ValueError(f"未知的任务类型: {job['kind']}")
+        with job_heartbeat(job['id']):
+            handler(json.loads(job['payload']))
+    except Exception as e:
+        duration_ms = round((time.monotonic() - started) * 1000, 1)
+        retry = job['attempts'] < job['max_attempts']
+        app.logger.warning(f"后台任务 {job['id']} ({job['kind']}) 第{job['attempts']}次执行失败: {str(e)}")
+        with get_db() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = ?, run_after = ?, error = ?, finished_at = ?, duration_ms = ?
+                WHERE id = ?
+            ''', (
+                'pending' if retry else 'failed',
+                time.time() + 2 ** job['attempts'],
+                str(e),
+                None if retry else time.time(),
+                duration_ms,
+                job['id']
+            ))
+            conn.commit()
+        return False
+    
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+    with get_db() as conn:
+        conn.execute('''
+            UPDATE jobs SET status = 'done', error = NULL, finished_at = ?, duration_ms = ?
+            WHERE id = ?
+        ''', (time.time(), duration_ms, job['id']))
+        conn.commit()
+    return True
+
+def run_pending_jobs():
+    """在当前线程中执行所有到期任务，返回(成功数, 失败数)"""
+    succeeded = failed = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return succeeded, failed
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+
+def requeue_stale_jobs():
+    """把超过JOB_TIMEOUT没有心跳的运行中任务（所在进程已中断）重新排队，返回数量
+
+    仍在执行的任务由job_heartbeat定期更新心跳，运行时间再长也不会被重复执行。
+    """
+    with get_db() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'pending' WHERE status = 'running' "
+            "AND COALESCE(heartbeat_at, started_at) < ?",
+            (time.time() - JOB_TIMEOUT,)
+        )
+        conn.commit()
+    return cursor.rowcount
+
+def job_info(row):
+    """任务状态信息"""
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'error': row['error'],
+        'created_at': datetime.utcfromtimestamp(row['created_at']).isoformat(),
+        'started_at': datetime.utcfromtimestamp(row['started_at']).isoformat() if row['started_at'] else None,
+        'finished_at': datetime.utcfromtimestamp(row['finished_at']).isoformat() if row['finished_at'] else None,
+        'duration_ms': row['duration_ms']
+    }
+
+class JobWorkerPool:
+    """从jobs表领取并执行任务的工作线程池"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self.succeeded = 0
+        self.failed = 0
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        requeue_stale_jobs()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def notify(self):
+        """有新任务入队时唤醒空闲的工作线程"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = claim_job()
+            except sqlite3.Error as e:
+                app.logger.error(f"领取后台任务失败: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            if run_job(job):
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        with get_db() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {
+            'workers': len(self._threads),
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'queue': counts
+        }
+
+job_pool = JobWorkerPool(JOB_WORKERS)
+
+@job_handler('precompress')
+def precompress_job(payload):
+    """为blob生成预压缩副本，并链接到所有引用该blob的用户文件旁"""
+    content_hash = payload['content_hash']
+    blob_path = os.path.join(BLOB_FOLDER, content_hash[:2], content_hash)
+    if not os.path.exists(blob_path):
+        return
+    written = write_compressed_sidecars(blob_path)
+    
+    with blob_lock:
+        sidecars = [
+            suffix for suffix in PRECOMPRESSED_SUFFIXES.values()
+            if os.path.exists(blob_path + suffix)
+        ]
+        if not os.path.exists(blob_path):
+            # 生成期间blob已被删除，清理刚写入的副本
+            for suffix in sidecars:
+                os.remove(blob_path + suffix)
+            return
+        with get_db() as conn:
+            rows = conn.execute(
+                'SELECT user_uuid, saved_name FROM uploads WHERE content_hash = ?',
+                (content_hash,)
+            ).fetchall()
+        for row in rows:
+            file_path = get_upload_path(row['user_uuid'], row['saved_name'])
+            if not os.path.isfile(file_path):
+                continue
+            for suffix in sidecars:
+                if not os.path.exists(file_path + suffix):
+                    os.link(blob_path + suffix, file_path + suffix)
+    return written
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+    """在前台执行所有待处理的后台任务"""
+    init_db()
+    succeeded, failed = run_pending_jobs()
+    print(f"已执行 {succeeded + failed} 个后台任务，失败 {failed} 个")
+
+def start_background_services(debug=False):
+    """启动后台任务；调试模式下只在重载器的子进程中启动，避免重复运行"""
+    if debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+    maintenance_worker.start()
+    job_pool.start()
+
+@app.cli.command('run-maintenance')
+def run_maintenance_command():
+    """立即执行一次数据库维护"""
+    init_db()
+    result = run_maintenance()
+    print(f"已清理 {result['expired_sessions']} 个过期会话、{result['inactive_sessions']} 个失效会话、"
+          f"{result['revoked_tokens']} 条过期注销记录、{result['upload_sessions']} 个过期上传会话、"
+          f"{result['orphan_blobs']} 个无引用blob、{result['finished_jobs']} 个已结束任务，"
+          f"修正 {result['storage_drift']} 个用户的存储用量，清理 {result['rate_limit_buckets']} 个空闲限流令牌桶，"
+          f"回收 {result['pages_freed']} 页，"
+          f"耗时 {maintenance_stats['last_duration_ms']}ms")
+
+@app.cli.command('reconcile-storage')
+def reconcile_storage_command():
+    """按上传索引重新计算用户存储用量"""
+    init_db()
+    drifted = reconcile_user_storage()
+    print(f"已修正 {drifted} 个用户的存储用量计数")
+
+def replace_with_link(source_path, target_path):
+    """用指向source_path的硬链接原子替换target_path"""
+    tmp_path = target_path + '.link'
+    os.link(source_path, tmp_path)
+    os.replace(tmp_path, target_path)
+
+def dedupe_uploads():
+    """把升级前的独立上传文件并入blob存储，相同内容只保留一份，返回(处理数, 节省字节数)"""
+    processed = 0
+    saved_bytes = 0
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT user_uuid, saved_name, content_hash FROM uploads WHERE content_hash IS NOT NULL'
+        ).fetchall()
+    
+    with blob_lock:
+        for row in rows:
+            file_path = get_upload_path(row['user_uuid'], row['saved_name'])
+            if not os.path.isfile(file_path):
+                continue
+            blob_path = get_blob_path(row['content_hash'])
+            paths = [(file_path, blob_path)] + [
+                (file_path + suffix, blob_path + suffix) for suffix in PRECOMPRESSED_SUFFIXES.values()
+            ]
+            for path, blob_variant in paths:
+                if not os.path.isfile(path):
+                    continue
+                if not os.path.exists(blob_variant):
+                    os.link(path, blob_variant)
+                elif not os.path.samefile(path, blob_variant):
+                    saved_bytes += os.path.getsize(path)
+                    replace_with_link(blob_variant, path)
+            processed += 1
+        
+        with get_db() as conn:
+            conn.execute('''
+                INSERT INTO blobs (hash, size, refcount)
+                SELECT content_hash, MAX(size), COUNT(*) FROM uploads
+                WHERE content_hash IS NOT NULL GROUP BY content_hash
+                ON CONFLICT(hash) DO UPDATE SET refcount = excluded.refcount
+            ''')
+            conn.commit()
+    return processed, saved_bytes
+
+@app.cli.command('dedupe-uploads')
+def dedupe_uploads_command():
+    """把已有上传文件并入内容寻址存储"""
+    init_db()
+    processed, saved_bytes = dedupe_uploads()
+    print(f"已处理 {processed} 个上传文件，节省 {saved_bytes} 字节")
+
+def split_stored_specs(content_hash):
+    """把升级前入库的specs blob拆分为主文档和side文件并迁移所有引用，返回新的blob哈希
+
+    无需拆分或blob不存在时返回None。调用方需持有blob_lock。
+    """
+    blob_path = os.path.join(BLOB_FOLDER, content_hash[:2], content_hash)
+    if not os.path.isfile(blob_path):
+        return None
+    specs_index, _ = scan_specs_file(blob_path)
+    if not has_split_sections(specs_index):
+        return None
+    
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    split_path = os.path.join(STAGING_FOLDER, f"{content_hash}.split")
+    specs_index, new_hash = split_specs_file(blob_path, split_path, specs_index)
+    new_blob_path = get_blob_path(new_hash)
+    if os.path.exists(new_blob_path):
+        discard_staged(split_path)
+    else:
+        for suffix in SPLIT_SECTIONS.values():
+            if os.path.exists(split_path + suffix):
+                os.replace(split_path + suffix, new_blob_path + suffix)
+        os.replace(split_path, new_blob_path)
+    size = os.path.getsize(new_blob_path)
+    stored_size = blob_stored_size(new_hash, size, specs_index['split'])
+    
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT user_uuid, saved_name FROM uploads WHERE content_hash = ?', (content_hash,)
+        ).fetchall()
+    for row in rows:
+        file_path = get_upload_path(row['user_uuid'], row['saved_name'])
+        if not os.path.isfile(file_path):
+            continue
+        replace_with_link(new_blob_path, file_path)
+        # 旧内容的预压缩副本作废，由precompress任务重新生成
+        for suffix in PRECOMPRESSED_SUFFIXES.values():
+            if os.path.exists(file_path + suffix):
+                os.remove(file_path + suffix)
+    
+    with get_db() as conn:
+        # 拆分后主文档与side文件的总大小与原内容不同，按用户修正存储用量
+        for usage_row in conn.execute('''
+            SELECT user_uuid, SUM(stored_size) AS bytes, COUNT(*) AS files FROM uploads
+            WHERE content_hash = ? GROUP BY user_uuid
+        ''', (content_hash,)).fetchall():
+            storage_add(conn, usage_row['user_uuid'], usage_row['files'] * stored_size - usage_row['bytes'], 0)
+        conn.execute('''
+            UPDATE uploads SET content_hash = ?, sections = ?, split_sections = ?, stored_size = ?
+            WHERE content_hash = ?
+        ''', (
+            new_hash, json.dumps(specs_index['sections']), json.dumps(specs_index['split']),
+            stored_size, content_hash
+        ))
+        conn.execute('''
+            INSERT INTO blobs (hash, size, refcount)
+            SELECT ?, ?, refcount FROM blobs WHERE hash = ?
+            ON CONFLICT(hash) DO UPDATE SET refcount = blobs.refcount + excluded.refcount
+        ''', (new_hash, size, content_hash))
+        conn.execute('DELETE FROM blobs WHERE hash = ?', (content_hash,))
+        conn.execute('UPDATE blob_aliases SET blob_hash = ? WHERE blob_hash = ?', (new_hash, content_hash))
+        conn.execute(
+            'INSERT OR REPLACE INTO blob_aliases (hash, blob_hash) VALUES (?, ?)', (content_hash, new_hash)
+        )
+        if is_precompressible(size):
+            enqueue_job(conn, 'precompress', {'content_hash': new_hash})
+        bump_catalog_version(conn)
+        conn.commit()
+    
+    for path in [blob_path] + [blob_path + suffix for suffix in PRECOMPRESSED_SUFFIXES.values()]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return new_hash
+
+@app.cli.command('split-specs')
+def split_specs_command():
+    """把已有specs中的raw_api_response等字段拆到side文件（需先执行dedupe-uploads）"""
+    init_db()
+    with get_db() as conn:
+        hashes = [row['content_hash'] for row in conn.execute('''
+            SELECT DISTINCT content_hash FROM uploads
+            WHERE saved_name LIKE '%.specs' AND content_hash IS NOT NULL AND split_sections IS NULL
+        ''').fetchall()]
+    split = 0
+    with blob_lock:
+        for content_hash in hashes:
+            try:
+                if split_stored_specs(content_hash):
+                    split += 1
+            except ValueError as e:
+                print(f"跳过 {content_hash}: {str(e)}")
+    job_pool.notify()
+    # 拆分后文件变小，按新的大小重新计算存储用量
+    reconcile_user_storage()
+    print(f"已检查 {len(hashes)} 个specs内容，拆分 {split} 个")
+
+def shard_user_uploads(user_uuid):
+    """把用户目录根下的上传文件移入yyyy/mm分片目录，返回(移动数, 跳过数)
+
+    每个文件先在分片目录建立硬链接（预压缩副本在前），再删除旧路径，
+    get_upload_path在迁移期间总能找到文件，服务无需停机。
+    """
+    user_dir = os.path.join(UPLOAD_FOLDER, user_uuid)
+    moved = 0
+    skipped = 0
+    for filename in sorted(os.listdir(user_dir)):
+        flat_path = os.path.join(user_dir, filename)
+        if is_precompressed_sidecar(filename) or not os.path.isfile(flat_path):
+            continue
+        target_path = sharded_upload_path(user_uuid, filename)
+        if target_path == flat_path:
+            continue
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        
+        with blob_lock:
+            # 迁移期间文件可能已被删除
+            if not os.path.exists(flat_path):
+                continue
+            variants = [''] + [
+                suffix for suffix in PRECOMPRESSED_SUFFIXES.values() if os.path.exists(flat_path + suffix)
+            ]
+            if any(os.path.exists(target_path + suffix) and not os.path.samefile(flat_path + suffix, target_path + suffix)
+                   for suffix in variants):
+                app.logger.warning(f"分片目录中已存在不同的 {filename}，跳过")
+                skipped += 1
+                continue
+            for suffix in reversed(variants):
+                if not os.path.exists(target_path + suffix):
+                    os.link(flat_path + suffix, target_path + suffix)
+            for suffix in variants:
+                os.remove(flat_path + suffix)
+        moved += 1
+    return moved, skipped
+
+@app.cli.command('shard-uploads')
+def shard_uploads_command():
+    """把扁平布局的上传文件在线迁移到<uuid>/<yyyy>/<mm>/分片目录"""
+    init_db()
+    moved = 0
+    skipped = 0
+    for user_uuid in sorted(os.listdir(UPLOAD_FOLDER)):
+        if user_uuid.startswith('.') or not os.path.isdir(os.path.join(UPLOAD_FOLDER, user_uuid)):
+            continue
+        user_moved, user_skipped = shard_user_uploads(user_uuid)
+        moved += user_moved
+        skipped += user_skipped
+    print(f"已迁移 {moved} 个上传文件，跳过 {skipped} 个")
 
 def generate_jwt_token(user_data):
     """生成JWT令牌"""
     import uuid
     payload = {
         'user_id': user_data['id'],
+        'user_uuid': user_data['uuid'],
         'email': user_data['email'],
+        'name': user_data['name'],
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRE_HOURS),
         'iat': datetime.utcnow(),
         'jti': str(uuid.uuid4())  # JWT ID - 确保token唯一性
@@ -179,14 +2758,27 @@ def generate_jwt_token(user_data):
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
 def verify_jwt_token(token):
-    """验证JWT令牌"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+    """验证JWT令牌，已验证和无效的令牌都会按摘要缓存"""
+    token_digest = hashlib.sha256(token.encode('utf-8')).digest()
+    
+    payload = verified_token_cache.get(token_digest)
+    if payload is not None:
         return payload
+    if invalid_token_cache.get(token_digest) is not None:
+        return None
+    
+    try:
+        # 缓存按exp过期，没有exp的令牌视为无效
+        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'], options={'require': ['exp']})
     except jwt.ExpiredSignatureError:
+        invalid_token_cache.set(token_digest, True)
         return None
     except jwt.InvalidTokenError:
+        invalid_token_cache.set(token_digest, True)
         return None
+    
+    verified_token_cache.set(token_digest, payload, expires_at=payload['exp'])
+    return payload
 
 def require_auth(f):
     """认证装饰器"""
@@ -201,12 +2793,107 @@ def require_auth(f):
         if not payload:
             return jsonify({'error': '无效或过期的令牌'}), 401
         
+        # 已登出的令牌在内存索引中即可判定，无需查询数据库
+        if revocation_index.is_revoked(payload.get('jti')):
+            return jsonify({'error': '令牌已注销'}), 401
+        
         # 将用户信息添加到请求上下文
         request.current_user = payload
         return f(*args, **kwargs)
     
     return decorated_function
 
+def require_stats_access(f):
+    """运行统计接口的访问控制：X-Stats-Token与SYSTEM_STATS_TOKEN一致，或来自本机的直接请求
+
+    经反向代理转发的请求对端地址也是本机，带X-Forwarded-For的请求不视为本机访问。
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.headers.get('X-Stats-Token', '')
+        if SYSTEM_STATS_TOKEN and hmac.compare_digest(token.encode('utf-8'), SYSTEM_STATS_TOKEN.encode('utf-8')):
+            return f(*args, **kwargs)
+        is_local = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+        if not SYSTEM_STATS_TOKEN and is_local:
+            return f(*args, **kwargs)
+        return jsonify({'error': '访问被拒绝'}), 403
+    
+    return decorated_function
+
+def rate_limit_key():
+    """限流计数的主体：已认证请求按用户，匿名请求按客户端IP"""
+    current_user = getattr(request, 'current_user', None)
+    if current_user:
+        return f"user:{current_user.get('user_uuid') or current_user.get('user_id')}"
+    if RATE_LIMIT_PROXY_HOPS:
+        # 左侧的地址由客户端自行填写，只取可信代理从右侧追加的那一项
+        forwarded = [
+            addr.strip() for addr in request.headers.get('X-Forwarded-For', '').split(',') if addr.strip()
+        ]
+        if len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return f"ip:{forwarded[-RATE_LIMIT_PROXY_HOPS]}"
+    return f"ip:{request.remote_addr}"
+
+def rate_limit(route):
+    """限流装饰器，放在require_auth之后时按用户计数；超出限制返回429和Retry-After"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            retry_after = rate_limiter.acquire(route, rate_limit_key())
+            if retry_after:
+                response = jsonify({'error': '请求过于频繁，请稍后再试', 'retry_after': retry_after})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def get_user_names(conn, user_uuids):
+    """批量获取用户名，优先读取内存缓存，未命中的用户一次查询"""
+    names = {}
+    missing = []
+    for user_uuid in user_uuids:
+        name = user_name_cache.get(user_uuid)
+        if name is None:
+            missing.append(user_uuid)
+        else:
+            names[user_uuid] = name
+
+    # SQLite单条语句的参数数量有限，分批查询
+    for start in range(0, len(missing), 500):
+        batch = missing[start:start + 500]
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(
+            f'SELECT uuid, name FROM users WHERE uuid IN ({placeholders})', batch
+        ).fetchall()
+        found = {row[0]: row[1] for row in rows}
+        for user_uuid in batch:
+            names[user_uuid] = found.get(user_uuid, '')
+            user_name_cache.set(user_uuid, names[user_uuid])
+    return names
+
+def get_user_by_id(user_id):
+    """按ID获取用户记录，优先读取带TTL的内存缓存，用户不存在时返回None"""
+    user = user_row_cache.get(user_id)
+    if user is None:
+        with get_db() as conn:
+            row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        if not row:
+            return None
+        user = dict(row)
+        user_row_cache.set(user_id, user)
+    return user
+
+def get_current_user_uuid():
+    """获取当前请求用户的UUID，优先使用令牌中携带的user_uuid"""
+    user_uuid = request.current_user.get('user_uuid')
+    if user_uuid:
+        return user_uuid
+    # 旧版令牌不含user_uuid，回退到用户记录缓存
+    user = get_user_by_id(request.current_user['user_id'])
+    return user['uuid'] if user else None
+
 def get_or_create_user(user_info, provider='google'):
     """获取或创建用户 - 增强版支持完整OAuth信息"""
     import uuid
@@ -233,19 +2920,25 @@ def get_or_create_user(user_info, provider='google'):
     if not email or not provider_id:
         raise ValueError('缺少必要的用户信息: email或provider_id')
     
-    with sqlite3.connect(DATABASE) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         cursor = conn.cursor()
         
-        # 尝试通过邮箱或provider_id查找用户
-        cursor.execute(
-            'SELECT * FROM users WHERE email = ? OR (provider = ? AND provider_id = ?)',
-            (email, provider, provider_id)
-        )
+        # 尝试通过邮箱或provider_id查找用户，分两次查询以各自使用唯一索引
+        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
         user = cursor.fetchone()
+        if not user:
+            cursor.execute(
+                'SELECT * FROM users WHERE provider = ? AND provider_id = ?',
+                (provider, provider_id)
+            )
+            user = cursor.fetchone()
         
         if user:
             # 更新用户信息 - 包含所有增强字段
+            # 用户名变化会影响公开列表中的user_name
+            if user['name'] != name:
+                bump_catalog_version(conn)
+            
             cursor.execute('''
                 UPDATE users 
                 SET name = ?, avatar_url = ?, email_verified = ?, given_name = ?, 
@@ -257,6 +2950,9 @@ def get_or_create_user(user_info, provider='google'):
                   locale, sub_id, profile_link, gender, hosted_domain, 
                   oauth_response_raw, user['id']))
             conn.commit()
+            # 提交后再失效缓存：提交前并发的读取会把旧记录重新放回缓存
+            user_name_cache.pop(user['uuid'])
+            user_row_cache.pop(user['id'])
             
             # 重新获取更新后的用户信息
             cursor.execute('SELECT * FROM users WHERE id = ?', (user['id'],))
@@ -449,14 +3145,14 @@ def google_callback():
         user = get_or_create_user(user_info, 'google')
         jwt_token = generate_jwt_token(user)
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_db() as conn:
             conn.execute('DELETE FROM user_sessions WHERE user_id = ?', (user['id'],))
             conn.execute('''
-                INSERT INTO user_sessions (user_id, token, expires_at, ip_address, user_agent)
+                INSERT INTO user_sessions (user_id, token_hash, expires_at, ip_address, user_agent)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
                 user['id'],
-                jwt_token,
+                hash_session_token(jwt_token),
                 datetime.utcnow() + timedelta(hours=JWT_EXPIRE_HOURS),
                 request.remote_addr,
                 request.user_agent.string
@@ -486,27 +3182,20 @@ def google_callback():
 @require_auth
 def validate_token():
     """验证JWT令牌"""
-    user_id = request.current_user['user_id']
+    user = get_user_by_id(request.current_user['user_id'])
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
     
-    with sqlite3.connect(DATABASE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            return jsonify({'error': '用户不存在'}), 404
-        
-        return jsonify({
-            'valid': True,
-            'user': {
-                'id': user['uuid'],
-                'email': user['email'],
-                'name': user['name'],
-                'avatar': user['avatar_url'],
-                'provider': user['provider']
-            }
-        })
+    return jsonify({
+        'valid': True,
+        'user': {
+            'id': user['uuid'],
+            'email': user['email'],
+            'name': user['name'],
+            'avatar': user['avatar_url'],
+            'provider': user['provider']
+        }
+    })
 
 @app.route('/api/auth/logout', methods=['POST'])
 @require_auth
@@ -515,38 +3204,56 @@ def logout():
     auth_header = request.headers.get('Authorization')
     token = auth_header.split(' ')[1]
     
-    with sqlite3.connect(DATABASE) as conn:
+    payload = request.current_user
+    
+    with get_db() as conn:
         conn.execute(
-            'UPDATE user_sessions SET is_active = FALSE WHERE token = ?',
-            (token,)
+            'UPDATE user_sessions SET is_active = FALSE WHERE token_hash = ?',
+            (hash_session_token(token),)
         )
+        if payload.get('jti'):
+            conn.execute(
+                'INSERT OR IGNORE INTO revoked_tokens (jti, user_id, expires_at) VALUES (?, ?, ?)',
+                (payload['jti'], payload['user_id'], int(payload['exp']))
+            )
         conn.commit()
     
+    if payload.get('jti'):
+        revocation_index.add(payload['jti'], int(payload['exp']))
+    
     return jsonify({'success': True, 'message': '登出成功'})
 
 @app.route('/api/users/profile', methods=['GET'])
 @require_auth
 def get_user_profile():
     """获取用户资料"""
-    user_id = request.current_user['user_id']
+    user = get_user_by_id(request.current_user['user_id'])
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
     
-    with sqlite3.connect(DATABASE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            return jsonify({'error': '用户不存在'}), 404
-        
-        return jsonify({
-            'id': user['uuid'],
-            'email': user['email'],
-            'name': user['name'],
-            'avatar': user['avatar_url'],
-            'provider': user['provider'],
-            'created_at': user['created_at']
-        })
+    return jsonify({
+        'id': user['uuid'],
+        'email': user['email'],
+        'name': user['name'],
+        'avatar': user['avatar_url'],
+        'provider': user['provider'],
+        'created_at': user['created_at']
+    })
+
+@app.route('/api/users/storage', methods=['GET'])
+@require_auth
+def get_user_storage():
+    """获取当前用户的存储用量和配额"""
+    user_uuid = get_current_user_uuid()
+    if not user_uuid:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    usage = get_storage_usage(user_uuid)
+    return jsonify({
+        'success': True,
+        'usage': usage,
+        'quota': {'bytes': USER_QUOTA_BYTES or None, 'files': USER_QUOTA_FILES or None}
+    })
 
 @app.route('/api/auth/extension/register', methods=['POST'])
 def extension_register():
@@ -584,17 +3291,17 @@ def extension_register():
         jwt_token = generate_jwt_token(user)
         
         # 记录会话
-        with sqlite3.connect(DATABASE) as conn:
+        with get_db() as conn:
             # 清理该用户的旧会话，避免token冲突
             conn.execute('DELETE FROM user_sessions WHERE user_id = ?', (user['id'],))
             
             # 插入新会话
             conn.execute('''
-                INSERT INTO user_sessions (user_id, token, expires_at, ip_address, user_agent)
+                INSERT INTO user_sessions (user_id, token_hash, expires_at, ip_address, user_agent)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
                 user['id'],
-                jwt_token,
+                hash_session_token(jwt_token),
                 datetime.utcnow() + timedelta(hours=JWT_EXPIRE_HOURS),
                 request.remote_addr,
                 request.user_agent.string
@@ -620,439 +3327,785 @@ def extension_register():
 @require_auth
 def extension_validate():
     """浏览器插件令牌验证"""
-    user_id = request.current_user['user_id']
+    user = get_user_by_id(request.current_user['user_id'])
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
     
-    with sqlite3.connect(DATABASE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            return jsonify({'error': '用户不存在'}), 404
-        
-        return jsonify({
-            'valid': True,
-            'user': {
-                'id': user['uuid'],
-                'email': user['email'],
-                'name': user['name'],
-                'avatar': user['avatar_url']
-            }
-        })
+    return jsonify({
+        'valid': True,
+        'user': {
+            'id': user['uuid'],
+            'email': user['email'],
+            'name': user['name'],
+            'avatar': user['avatar_url']
+        }
+    })
+
+def stream_to_staging(stream, filename, limit=None):
+    """ingest阶段：上传流单遍写入暂存文件，同时计算sha256；.specs文件同时校验并建立字段索引
+
+    返回(暂存路径, 内容哈希, specs_index)，非.specs文件的specs_index为None。
+    校验失败时删除暂存文件并抛出ValueError；内容超过limit字节时删除暂存文件并抛出RequestEntityTooLarge。
+    """
+    import uuid
+    staging_path = get_staging_path(uuid.uuid4().hex)
+    specs_index = None
+    try:
+        with open(staging_path, 'wb') as f:
+            reader = IngestReader(stream, f, limit)
+            if filename.endswith('.specs'):
+                specs_index = scan_specs(reader)
+            reader.drain()
+            # 返回前确保内容已落盘
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(staging_path)
+        raise
+    return staging_path, reader.hexdigest(), specs_index
+
+# 本进程最近一次分配的上传时间，由持有blob_lock的ingest_upload读写
+_last_upload_time = datetime.min
+
+def upload_timestamp_taken(user_uuid, timestamp, file_extension):
+    """时间戳是否已被该用户占用：索引中已有该时间戳，或任一扩展名的同名文件已在磁盘上
+
+    索引以(user_uuid, timestamp)为唯一键，不同扩展名的文件也不能共用一个时间戳。
+    """
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT 1 FROM uploads WHERE user_uuid = ? AND timestamp = ?', (user_uuid, timestamp)
+        ).fetchone()
+    if row:
+        return True
+    extensions = {f'.{ext}' for ext in ALLOWED_EXTENSIONS} | {file_extension}
+    return any(
+        os.path.exists(get_upload_path(user_uuid, f"{timestamp}{ext}")) for ext in extensions
+    )
+
+def split_staged_upload(filename, staging_path, content_hash, specs_index=None):
+    """ingest阶段，在获取blob_lock之前调用：把.specs中SPLIT_SECTIONS列出的字段拆到side文件
+
+    返回(暂存路径, 内容哈希, specs_index, source_hash)。拆分后暂存路径指向主文档，
+    内容哈希为主文档哈希，source_hash为原始上传内容的哈希，specs_index['source_size']为原始上传内容的大小；
+    无需拆分时原样返回，source_hash为None。
+    .specs格式校验失败时删除暂存文件并抛出ValueError。
+    """
+    if not secure_filename(filename).endswith('.specs'):
+        return staging_path, content_hash, specs_index, None
+    try:
+        # .specs文件在上传时校验一次，读取时直接透传
+        if specs_index is None:
+            specs_index, _ = scan_specs_file(staging_path)
+        if not has_split_sections(specs_index):
+            return staging_path, content_hash, specs_index, None
+        split_path = staging_path + '.split'
+        source_size = os.path.getsize(staging_path)
+        try:
+            specs_index, split_hash = split_specs_file(staging_path, split_path, specs_index)
+        finally:
+            os.remove(staging_path)
+    except (ValueError, OSError):
+        discard_staged(staging_path)
+        discard_staged(staging_path + '.split')
+        raise
+    specs_index['source_size'] = source_size
+    return split_path, split_hash, specs_index, content_hash
+
+def ingest_upload(user_uuid, filename, content_hash, staging_path=None, specs_index=None, source_hash=None):
+    """把上传内容存入blob并链接到用户目录，返回(file_info, 索引记录)，调用方需持有blob_lock
+
+    相同内容的blob已存在时丢弃暂存文件直接链接；staging_path为None表示只引用已有blob，
+    blob不存在时抛出FileNotFoundError。.specs需已经过split_staged_upload拆分，
+    blob以拆分后主文档的哈希寻址，source_hash为拆分前原始内容的哈希。
+    索引记录和blob引用由commit_uploads统一写入。
+    """
+    original_filename = secure_filename(filename)
+    _, file_extension = os.path.splitext(original_filename)
+    is_specs = file_extension == '.specs'
+    
+    if staging_path is None:
+        content_hash = resolve_blob_hash(content_hash)
+        blob_path = get_blob_path(content_hash)
+        if not os.path.exists(blob_path):
+            raise FileNotFoundError(content_hash)
+        # 按哈希登记时ingest阶段未扫描过，扫描已拆分的主文档；上传大小沿用已有记录中原始内容的大小
+        if is_specs and specs_index is None:
+            specs_index, _ = scan_specs_file(blob_path)
+            specs_index['split'] = blob_split_sections(blob_path)
+            if specs_index['split']:
+                with get_db() as conn:
+                    existing = conn.execute(
+                        'SELECT size FROM uploads WHERE content_hash = ? LIMIT 1', (content_hash,)
+                    ).fetchone()
+                if existing:
+                    specs_index['source_size'] = existing['size']
+    else:
+        blob_path = get_blob_path(content_hash)
+    
+    deduplicated = os.path.exists(blob_path)
+    if staging_path:
+        if deduplicated:
+            discard_staged(staging_path)
+        else:
+            # side文件先于主文档就位，blob存在即说明拆分完整；预压缩副本由后台任务生成，见commit_uploads
+            for suffix in SPLIT_SECTIONS.values():
+                if os.path.exists(staging_path + suffix):
+                    os.replace(staging_path + suffix, blob_path + suffix)
+            os.replace(staging_path, blob_path)
+    
+    # 生成时间戳文件名 (YYYYMMDD_HHMMSS_ms)，时间戳已被占用时顺延1毫秒；
+    # 同一进程内分配的时间严格递增，批量上传中尚未提交索引的文件也不会重复
+    global _last_upload_time
+    upload_time = max(datetime.utcnow(), _last_upload_time + timedelta(milliseconds=1))
+    while True:
+        timestamp = upload_time.strftime('%Y%m%d_%H%M%S_%f')[:-3]
+        new_filename = f"{timestamp}{file_extension}"
+        file_path = sharded_upload_path(user_uuid, new_filename)
+        if not upload_timestamp_taken(user_uuid, timestamp, file_extension):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            try:
+                link_blob(blob_path, file_path)
+                break
+            except FileExistsError:
+                pass
+        upload_time += timedelta(milliseconds=1)
+    _last_upload_time = upload_time
+    remember_file_etag(file_path, content_hash)
+    
+    entry = build_catalog_entry(user_uuid, new_filename, content_hash, specs_index)
+    file_info = {
+        'original_name': original_filename,
+        'saved_name': new_filename,
+        'timestamp': timestamp,
+        'size': entry['size'] if entry else os.path.getsize(file_path),
+        'content_hash': content_hash,
+        'deduplicated': deduplicated,
+        'user_uuid': user_uuid,
+        'storage_path': 'upload/' + os.path.relpath(file_path, UPLOAD_FOLDER).replace(os.sep, '/')
+    }
+    if source_hash:
+        file_info['source_hash'] = source_hash
+    if specs_index and specs_index.get('split'):
+        file_info['split_sections'] = specs_index['split']
+        file_info['primary_size'] = os.path.getsize(file_path)
+    return file_info, entry
+
+def commit_uploads(ingested):
+    """在一个事务中写入uploads索引记录和blob引用，ingested为ingest_upload返回值列表
+
+    新blob的预压缩在同一事务中入队，file_info['job_id']为对应任务ID。
+    索引记录用catalog_insert写入，时间戳冲突时整个事务失败，不会覆盖其他上传的记录。
+    """
+    if not ingested:
+        return
+    with get_db() as conn:
+        for file_info, entry in ingested:
+            if entry:
+                catalog_insert(conn, entry)
+            # blob记录的是主文档大小，拆分过的.specs与上传大小不同
+            blob_size = file_info.get('primary_size', file_info['size'])
+            blob_acquire(conn, file_info['content_hash'], blob_size)
+            # 用量按主文档加side文件计算，拆出的raw_api_response同样计入配额
+            storage_add(conn, file_info['user_uuid'], entry['stored_size'] if entry else file_info['size'], 1)
+            if file_info.get('source_hash'):
+                conn.execute(
+                    'INSERT OR REPLACE INTO blob_aliases (hash, blob_hash) VALUES (?, ?)',
+                    (file_info['source_hash'], file_info['content_hash'])
+                )
+            if not file_info['deduplicated'] and is_precompressible(blob_size):
+                file_info['job_id'] = enqueue_job(
+                    conn, 'precompress', {'content_hash': file_info['content_hash']},
+                    user_uuid=file_info['user_uuid']
+                )
+        bump_catalog_version(conn)
+        conn.commit()
+    job_pool.notify()
+
+def discard_ingested(file_info):
+    """索引写入失败时撤销ingest_upload：删除用户目录中的链接，本次新建的blob一并删除，调用方需持有blob_lock"""
+    file_path = get_upload_path(file_info['user_uuid'], file_info['saved_name'])
+    paths = [file_path] + [file_path + suffix for suffix in PRECOMPRESSED_SUFFIXES.values()]
+    if not file_info['deduplicated']:
+        blob_path = get_blob_path(file_info['content_hash'])
+        paths += [blob_path] + [blob_path + suffix for suffix in SPLIT_SECTIONS.values()]
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def store_upload(user_uuid, filename, content_hash, staging_path=None, specs_index=None):
+    """保存单个上传文件并更新索引，返回file_info；失败时清理暂存文件和已创建的链接"""
+    source_hash = None
+    if staging_path:
+        # 拆分需要完整拷贝并落盘，在获取blob_lock之前完成，不阻塞其他上传和删除
+        staging_path, content_hash, specs_index, source_hash = split_staged_upload(
+            filename, staging_path, content_hash, specs_index
+        )
+    with blob_lock:
+        try:
+            file_info, entry = ingest_upload(
+                user_uuid, filename, content_hash, staging_path, specs_index, source_hash
+            )
+        except Exception:
+            if staging_path:
+                discard_staged(staging_path)
+            raise
+        try:
+            commit_uploads([(file_info, entry)])
+        except Exception:
+            discard_ingested(file_info)
+            raise
+    return file_info
 
 @app.route('/api/upload', methods=['POST'])
 @require_auth
+@rate_limit('upload')
 def upload_file():
     """文件上传端点 (使用时间戳命名)"""
     try:
+        # 获取当前用户信息
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
+        
+        # 读取请求体之前按声明的大小检查配额
+        usage = get_storage_usage(user_uuid)
+        quota_error = storage_quota_error(user_uuid, request.content_length or 0, usage=usage)
+        if quota_error:
+            return quota_exceeded_response(quota_error)
+        
         if 'file' not in request.files:
             return jsonify({'error': '没有选择文件'}), 400
         
         file = request.files['file']
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
+        
+        # 边写入暂存文件边计算内容哈希、校验并索引specs；分块传输的请求没有Content-Length，
+        # 写入时按剩余配额限制字节数，写完后再按实际大小检查一次
+        limit = max(USER_QUOTA_BYTES - usage['bytes'], 0) if USER_QUOTA_BYTES else None
+        try:
+            staging_path, content_hash, specs_index = stream_to_staging(
+                file.stream, secure_filename(file.filename), limit=limit
+            )
+        except RequestEntityTooLarge:
+            return quota_exceeded_response(storage_quota_error(user_uuid, limit + 1, usage=usage))
+        quota_error = storage_quota_error(user_uuid, os.path.getsize(staging_path), usage=usage)
+        if quota_error:
+            os.remove(staging_path)
+            return quota_exceeded_response(quota_error)
+        file_info = store_upload(user_uuid, file.filename, content_hash, staging_path, specs_index)
+        return jsonify({
+            'success': True,
+            'message': '文件上传成功',
+            'file_info': file_info
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"文件上传错误: {str(e)}")
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
-        # 获取当前用户信息
-        user_id = request.current_user['user_id']
-        with sqlite3.connect(DATABASE) as conn:
-            user_uuid = conn.execute('SELECT uuid FROM users WHERE id = ?', (user_id,)).fetchone()[0]
-            if not user_uuid:
-                return jsonify({'error': '用户不存在'}), 404
+def upload_session_info(row):
+    """断点续传会话的进度信息"""
+    return {
+        'session_id': row['id'],
+        'filename': row['original_name'],
+        'size': row['total_size'],
+        'offset': row['received'],
+        'complete': row['received'] == row['total_size'],
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'expires_at': row['expires_at']
+    }
+
+def get_upload_session(session_id, user_uuid):
+    """读取当前用户的断点续传会话，不存在时返回None"""
+    with get_db() as conn:
+        return conn.execute(
+            'SELECT * FROM upload_sessions WHERE id = ? AND user_uuid = ?',
+            (session_id, user_uuid)
+        ).fetchone()
+
+def iter_batch_uploads():
+    """遍历批量上传请求中的文件，产出(文件名, 文件流)
+
+    支持multipart/form-data（多个files字段）和tar流（application/x-tar，可gzip压缩）。
+    """
+    if request.mimetype in ('application/x-tar', 'application/gzip', 'application/x-gzip'):
+        with tarfile.open(fileobj=request.stream, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield os.path.basename(member.name), archive.extractfile(member)
+    else:
+        for file in request.files.getlist('files') + request.files.getlist('file'):
+            yield file.filename, file.stream
+
+@app.route('/api/upload/batch', methods=['POST'])
+@require_auth
+@rate_limit('upload_batch')
+def upload_batch():
+    """批量上传：一次请求写入多个文件，索引在同一事务中提交，逐个返回结果"""
+    staged = []
+    try:
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
         
-        original_filename = secure_filename(file.filename)
-        _, file_extension = os.path.splitext(original_filename)
+        usage = get_storage_usage(user_uuid)
+        quota_error = storage_quota_error(user_uuid, request.content_length or 0, usage=usage)
+        if quota_error:
+            return quota_exceeded_response(quota_error)
         
-        # 生成时间戳文件名 (YYYYMMDD_HHMMSS_ms)
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')[:-3]
-        new_filename = f"{timestamp}{file_extension}"
+        # 暂存的总字节数不超过批量大小限制和剩余配额。gzip压缩的tar只受压缩后请求体大小的限制，
+        # 解压后的内容在写入暂存区时计数，超出即中止
+        staging_budget = BATCH_UPLOAD_MAX_SIZE
+        if USER_QUOTA_BYTES:
+            staging_budget = min(staging_budget, max(USER_QUOTA_BYTES - usage['bytes'], 0))
+        staged_bytes = 0
+        
+        # 先把所有文件写入暂存区（边写边计算哈希、校验并拆分specs），读取请求体时不持有blob_lock
+        for filename, stream in iter_batch_uploads():
+            if len(staged) >= BATCH_UPLOAD_MAX_FILES:
+                raise ValueError(f'单次最多上传 {BATCH_UPLOAD_MAX_FILES} 个文件')
+            if not secure_filename(filename or ''):
+                staged.append((filename, None, '无效的文件名'))
+                continue
+            try:
+                staging_path, content_hash, specs_index = stream_to_staging(
+                    stream, secure_filename(filename), limit=staging_budget - staged_bytes
+                )
+                staged_bytes += os.path.getsize(staging_path)
+                staging_path, content_hash, specs_index, source_hash = split_staged_upload(
+                    filename, staging_path, content_hash, specs_index
+                )
+            except ValueError as e:
+                staged.append((filename, None, str(e)))
+                continue
+            except RequestEntityTooLarge:
+                if staging_budget < BATCH_UPLOAD_MAX_SIZE:
+                    return quota_exceeded_response(
+                        storage_quota_error(user_uuid, staging_budget + 1, usage=usage)
+                    )
+                return jsonify({'error': f'批量上传内容超过大小限制 {BATCH_UPLOAD_MAX_SIZE} 字节'}), 413
+            staged.append((filename, staging_path, (content_hash, specs_index, source_hash)))
+        
+        if not staged:
+            return jsonify({'error': '没有选择文件'}), 400
+        
+        results = []
+        ingested = []
+        with blob_lock:
+            for filename, staging_path, staged_result in staged:
+                if staging_path is None:
+                    results.append({'filename': filename, 'success': False, 'error': staged_result})
+                    continue
+                content_hash, specs_index, source_hash = staged_result
+                # 逐个按实际大小检查配额，超出的文件不入库
+                quota_error = storage_quota_error(user_uuid, staged_size(staging_path), usage=usage)
+                if quota_error:
+                    discard_staged(staging_path)
+                    results.append({'filename': filename, 'success': False, 'error': quota_error})
+                    continue
+                try:
+                    file_info, entry = ingest_upload(
+                        user_uuid, filename, content_hash, staging_path, specs_index, source_hash
+                    )
+                except ValueError as e:
+                    results.append({'filename': filename, 'success': False, 'error': str(e)})
+                    continue
+                usage = {'bytes': usage['bytes'] + entry['stored_size'], 'files': usage['files'] + 1}
+                ingested.append((file_info, entry))
+                results.append({'filename': filename, 'success': True, 'file_info': file_info})
+            try:
+                commit_uploads(ingested)
+            except Exception:
+                for file_info, _ in ingested:
+                    discard_ingested(file_info)
+                raise
+        
+        return jsonify({
+            'success': True,
+            'message': f'成功上传 {len(ingested)} 个文件',
+            'uploaded': len(ingested),
+            'failed': len(results) - len(ingested),
+            'results': results
+        })
         
-        # 获取用户上传目录并保存
-        user_upload_dir = get_user_upload_dir(user_uuid)
-        file_path = os.path.join(user_upload_dir, new_filename)
-        file.save(file_path)
+    except (ValueError, tarfile.TarError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"批量上传错误: {str(e)}")
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+    finally:
+        # 出错中断时清理尚未入库的暂存文件
+        for _, staging_path, _ in staged:
+            if staging_path:
+                discard_staged(staging_path)
 
+@app.route('/api/upload/by-hash', methods=['POST'])
+@require_auth
+@rate_limit('upload')
+def upload_by_hash():
+    """当前用户已上传过相同内容时按sha256直接登记上传，无需再次传输文件"""
+    try:
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        content_hash = (data.get('sha256') or '').lower()
+        filename = data.get('filename') or ''
+        if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+            return jsonify({'error': '无效的sha256'}), 400
+        if not secure_filename(filename):
+            return jsonify({'error': '没有选择文件'}), 400
+        
+        # 只能引用自己已上传过的内容；其他用户的内容与不存在的内容返回相同的404，
+        # 避免通过哈希读取他人文件或探测服务器上是否存在某个文件
+        if not user_owns_content(user_uuid, content_hash):
+            return jsonify({'error': '服务器上不存在该内容', 'exists': False}), 404
+        
+        with get_db() as conn:
+            existing = conn.execute(
+                'SELECT stored_size FROM uploads WHERE user_uuid = ? AND content_hash = ? LIMIT 1',
+                (user_uuid, resolve_blob_hash(content_hash))
+            ).fetchone()
+        quota_error = storage_quota_error(user_uuid, existing['stored_size'] if existing else 0)
+        if quota_error:
+            return quota_exceeded_response(quota_error)
+        
+        try:
+            file_info = store_upload(user_uuid, filename, content_hash)
+        except FileNotFoundError:
+            return jsonify({'error': '服务器上不存在该内容', 'exists': False}), 404
         return jsonify({
             'success': True,
             'message': '文件上传成功',
-            'file_info': {
-                'original_name': original_filename,
-                'saved_name': new_filename,
-                'timestamp': timestamp,
-                'size': os.path.getsize(file_path),
-                'user_uuid': user_uuid,
-                'storage_path': f"upload/{user_uuid}/{new_filename}"
-            }
+            'file_info': file_info
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        app.logger.error(f"文件上传错误: {str(e)}")
+        app.logger.error(f"按哈希上传错误: {str(e)}")
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
-@app.route('/api/uploads/list', methods=['GET'])
+@app.route('/api/upload/sessions', methods=['POST'])
 @require_auth
-def get_user_uploads():
-    """获取当前用户的所有上传文件列表"""
+@rate_limit('upload')
+def create_upload_session():
+    """创建断点续传会话"""
     try:
-        # 获取当前用户信息
-        user_id = request.current_user['user_id']
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT uuid FROM users WHERE id = ?', (user_id,))
-            user_row = cursor.fetchone()
-            
-            if not user_row:
-                return jsonify({'error': '用户不存在'}), 404
-            
-            user_uuid = user_row['uuid']
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename') or '')
+        total_size = data.get('size')
+        if not filename:
+            return jsonify({'error': '没有选择文件'}), 400
+        if not isinstance(total_size, int) or total_size < 0:
+            return jsonify({'error': '缺少有效的文件大小'}), 400
+        if total_size > UPLOAD_SESSION_MAX_SIZE:
+            return jsonify({'error': f'文件超过大小限制 {UPLOAD_SESSION_MAX_SIZE} 字节'}), 413
+        
+        import uuid
+        session_id = uuid.uuid4().hex
+        now = int(time.time())
+        with get_db() as conn:
+            # 未完成的会话预占其声明的大小，检查和创建在同一写事务中，并发创建的会话不会绕过配额
+            conn.execute('BEGIN IMMEDIATE')
+            pending = conn.execute('''
+                SELECT COUNT(*) AS sessions, COALESCE(SUM(total_size), 0) AS bytes FROM upload_sessions
+                WHERE user_uuid = ? AND expires_at >= ?
+            ''', (user_uuid, now)).fetchone()
+            if pending['sessions'] >= UPLOAD_SESSION_MAX_OPEN:
+                conn.rollback()
+                return jsonify({
+                    'error': f'未完成的上传会话过多，最多 {UPLOAD_SESSION_MAX_OPEN} 个，请先完成或取消已有会话'
+                }), 429
+            quota_error = storage_quota_error(
+                user_uuid, pending['bytes'] + total_size, add_files=pending['sessions'] + 1
+            )
+            if quota_error:
+                conn.rollback()
+                return quota_exceeded_response(quota_error)
+            conn.execute('''
+                INSERT INTO upload_sessions (id, user_uuid, original_name, total_size, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (session_id, user_uuid, filename, total_size, now + UPLOAD_SESSION_TTL))
+            open(get_staging_path(session_id), 'wb').close()
+            conn.commit()
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+        
+        return jsonify({'success': True, **upload_session_info(row)}), 201
         
-        # 获取用户上传目录
-        user_upload_dir = get_user_upload_dir(user_uuid)
+    except Exception as e:
+        app.logger.error(f"创建上传会话错误: {str(e)}")
+        return jsonify({'error': f'创建上传会话失败: {str(e)}'}), 500
+
+@app.route('/api/upload/sessions/<session_id>', methods=['GET'])
+@require_auth
+def get_upload_session_progress(session_id):
+    """查询断点续传进度"""
+    row = get_upload_session(session_id, get_current_user_uuid())
+    if not row:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    return jsonify({'success': True, **upload_session_info(row)})
+
+@app.route('/api/upload/sessions/<session_id>', methods=['PUT'])
+@require_auth
+def upload_session_chunk(session_id):
+    """按偏移量写入一个分片，请求体为原始字节，Upload-Offset头指定起始偏移"""
+    try:
+        row = get_upload_session(session_id, get_current_user_uuid())
+        if not row:
+            return jsonify({'error': '上传会话不存在或已过期'}), 404
         
-        if not os.path.exists(user_upload_dir):
-            return jsonify({'files': [], 'total': 0})
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'error': '缺少有效的Upload-Offset头'}), 400
         
-        files = []
+        # 只接受从当前进度开始的分片，客户端据返回的offset重新对齐
+        if offset != row['received']:
+            return jsonify({'error': '分片偏移量与上传进度不一致', **upload_session_info(row)}), 409
         
-        # 遍历用户目录中的所有文件
-        processed_files = set()  # 记录已处理的时间戳，避免重复
+        staging_path = get_staging_path(session_id)
+        received = offset
+        with open(staging_path, 'r+b') as f:
+            # 丢弃上次中断时写入但未记录进度的字节
+            f.truncate(offset)
+            f.seek(offset)
+            while True:
+                chunk = request.stream.read(SPECS_SCAN_CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > row['total_size']:
+                    f.truncate(offset)
+                    return jsonify({'error': '分片超出声明的文件大小'}), 400
+                f.write(chunk)
+            # 记录进度前确保分片已落盘
+            f.flush()
+            os.fsync(f.fileno())
         
-        for filename in os.listdir(user_upload_dir):
-            file_path = os.path.join(user_upload_dir, filename)
-            
-            # 跳过目录
-            if os.path.isdir(file_path):
-                continue
-            
-            try:
-                # 解析时间戳
-                name_without_ext, file_extension = os.path.splitext(filename)
-                
-                # 处理.specs文件
-                if filename.endswith('.specs'):
-                    # 尝试从文件名中提取时间戳
-                    # 支持格式：timestamp.specs 或 projectname_context_timestamp.specs
-                    if '_context_' in name_without_ext:
-                        # 项目格式：projectname_context_timestamp
-                        timestamp_part = name_without_ext.split('_context_')[-1]
-                        # 处理ISO格式时间戳：2025-07-26_03-46-24-084Z
-                        timestamp = timestamp_part.replace('-', '').replace('Z', '')
-                    else:
-                        # 简单格式：直接使用文件名（去掉.specs）
-                        timestamp = name_without_ext
-                    
-                    # 避免重复处理
-                    if timestamp in processed_files:
-                        continue
-                    processed_files.add(timestamp)
-                    
-                    # 获取文件统计信息
-                    file_stat = os.stat(file_path)
-                    file_size = file_stat.st_size
-                    created_time = datetime.fromtimestamp(file_stat.st_ctime)
-                    modified_time = datetime.fromtimestamp(file_stat.st_mtime)
-                    
-                    # 从.specs文件中获取元数据
-                    file_metadata = {
-                        'name': f"上传文件: {filename}",
-                        'task_type': 'general_chat',
-                        'source_file': filename
-                    }
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as specs_file:
-                            specs_content = json.load(specs_file)
-                            # 安全访问可选的metadata字段
-                            if specs_content and 'metadata' in specs_content and specs_content['metadata']:
-                                metadata = specs_content['metadata']
-                                file_metadata.update({
-                                    'name': metadata.get('name') or file_metadata['name'],
-                                    'task_type': metadata.get('task_type') or file_metadata['task_type'],
-                                    'source_file': metadata.get('source_file') or file_metadata['source_file']
-                                })
-                    except (json.JSONDecodeError, IOError, TypeError):
-                        # 如果.specs文件损坏，使用默认元数据
-                        pass
-                    
-                    # 构建文件信息
-                    file_info = {
-                        'timestamp': timestamp,
-                        'original_name': file_metadata['source_file'],
-                        'saved_name': filename,
-                        'size': file_size,
-                        'created_at': created_time.isoformat(),
-                        'modified_at': modified_time.isoformat(),
-                        'name': file_metadata['name'],
-                        'task_type': file_metadata['task_type'],
-                        'source_file': file_metadata['source_file'],
-                        'specs_file': filename,
-                        'access_url': f"/api/{user_uuid}/{timestamp}.html"
-                    }
-                    
-                    files.append(file_info)
-                    
-                # 检查是否为时间戳格式的原始文件
-                elif len(name_without_ext) == 18 and '_' in name_without_ext:
-                    timestamp = name_without_ext
-                    
-                    # 避免重复处理
-                    if timestamp in processed_files:
-                        continue
-                    processed_files.add(timestamp)
-                    
-                    # 获取文件统计信息
-                    file_stat = os.stat(file_path)
-                    file_size = file_stat.st_size
-                    created_time = datetime.fromtimestamp(file_stat.st_ctime)
-                    modified_time = datetime.fromtimestamp(file_stat.st_mtime)
-                    
-                    # 检查是否存在对应的.specs文件
-                    specs_filename = f"{timestamp}.specs"
-                    specs_path = os.path.join(user_upload_dir, specs_filename)
-                    
-                    # 尝试从.specs文件中获取元数据 - 支持可选字段
-                    file_metadata = {
-                        'name': f"上传文件: {filename}",
-                        'task_type': 'document_analysis',
-                        'source_file': filename
-                    }
-                    
-                    if os.path.exists(specs_path):
-                        try:
-                            with open(specs_path, 'r', encoding='utf-8') as specs_file:
-                                specs_content = json.load(specs_file)
-                                # 安全访问可选的metadata字段
-                                if specs_content and 'metadata' in specs_content and specs_content['metadata']:
-                                    metadata = specs_content['metadata']
-                                    file_metadata.update({
-                                        'name': metadata.get('name') or file_metadata['name'],
-                                        'task_type': metadata.get('task_type') or file_metadata['task_type'],
-                                        'source_file': metadata.get('source_file') or file_metadata['source_file']
-                                    })
-                        except (json.JSONDecodeError, IOError, TypeError):
-                            # 如果.specs文件损坏或格式不正确，使用默认元数据
-                            pass
-                    
-                    # 构建文件信息
-                    file_info = {
-                        'timestamp': timestamp,
-                        'original_name': filename,
-                        'saved_name': filename,
-                        'size': file_size,
-                        'created_at': created_time.isoformat(),
-                        'modified_at': modified_time.isoformat(),
-                        'name': file_metadata['name'],
-                        'task_type': file_metadata['task_type'],
-                        'source_file': file_metadata['source_file'],
-                        'specs_file': specs_filename if os.path.exists(specs_path) else None,
-                        'access_url': f"/api/{user_uuid}/{timestamp}.html"
-                    }
-                    
-                    files.append(file_info)
-                    
-            except Exception as file_error:
-                app.logger.warning(f"处理文件 {filename} 时出错: {str(file_error)}")
-                continue
+        with get_db() as conn:
+            cursor = conn.execute('''
+                UPDATE upload_sessions SET received = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND received = ?
+            ''', (received, session_id, offset))
+            conn.commit()
+            if cursor.rowcount == 0:
+                row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+                return jsonify({'error': '分片偏移量与上传进度不一致', **upload_session_info(row)}), 409
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+        
+        return jsonify({'success': True, **upload_session_info(row)})
+        
+    except Exception as e:
+        app.logger.error(f"写入上传分片错误: {str(e)}")
+        return jsonify({'error': f'写入分片失败: {str(e)}'}), 500
+
+@app.route('/api/upload/sessions/<session_id>/complete', methods=['POST'])
+@require_auth
+def complete_upload_session(session_id):
+    """所有分片写入后完成上传，暂存文件原子重命名到用户目录"""
+    try:
+        user_uuid = get_current_user_uuid()
+        row = get_upload_session(session_id, user_uuid)
+        if not row:
+            return jsonify({'error': '上传会话不存在或已过期'}), 404
+        if row['received'] != row['total_size']:
+            return jsonify({'error': '文件尚未上传完成', **upload_session_info(row)}), 409
+        
+        # 会话创建后用量可能已变化，入库前再检查一次；超出时保留会话，腾出空间后可以重试
+        quota_error = storage_quota_error(user_uuid, row['total_size'])
+        if quota_error:
+            return quota_exceeded_response(quota_error)
         
-        # 按创建时间倒序排列
-        files.sort(key=lambda x: x['created_at'], reverse=True)
+        # 先删除会话记录，避免并发的完成请求重复入库
+        with get_db() as conn:
+            cursor = conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+            conn.commit()
+        if cursor.rowcount == 0:
+            return jsonify({'error': '上传会话不存在或已过期'}), 404
         
+        # 分片已全部落盘，单遍读取暂存文件计算哈希并校验索引specs；
+        # 会话记录已删除，任何一步失败都要清理暂存文件，不留下无人引用的文件
+        staging_path = get_staging_path(session_id)
+        try:
+            if row['original_name'].endswith('.specs'):
+                specs_index, content_hash = scan_specs_file(staging_path)
+            else:
+                specs_index, content_hash = None, sha256_file(staging_path)
+            file_info = store_upload(user_uuid, row['original_name'], content_hash, staging_path, specs_index)
+        except Exception:
+            discard_staged(staging_path)
+            raise
         return jsonify({
-            'files': files,
-            'total': len(files),
-            'user_uuid': user_uuid
+            'success': True,
+            'message': '文件上传成功',
+            'file_info': file_info
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"完成上传会话错误: {str(e)}")
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+
+@app.route('/api/upload/sessions/<session_id>', methods=['DELETE'])
+@require_auth
+def abort_upload_session(session_id):
+    """放弃断点续传会话并删除暂存文件"""
+    with get_db() as conn:
+        cursor = conn.execute(
+            'DELETE FROM upload_sessions WHERE id = ? AND user_uuid = ?',
+            (session_id, get_current_user_uuid())
+        )
+        conn.commit()
+    if cursor.rowcount == 0:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    try:
+        os.remove(get_staging_path(session_id))
+    except FileNotFoundError:
+        pass
+    return jsonify({'success': True, 'message': '上传会话已取消'})
+
+@app.route('/api/jobs', methods=['GET'])
+@require_auth
+def list_jobs():
+    """获取当前用户最近的后台任务"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': '无效的limit参数'}), 400
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT * FROM jobs WHERE user_uuid = ? ORDER BY id DESC LIMIT ?',
+            (get_current_user_uuid(), limit)
+        ).fetchall()
+    return jsonify({'success': True, 'jobs': [job_info(row) for row in rows]})
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    """查询后台任务状态"""
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT * FROM jobs WHERE id = ? AND user_uuid = ?',
+            (job_id, get_current_user_uuid())
+        ).fetchone()
+    if not row:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job_info(row)})
+
+@app.route('/api/uploads/list', methods=['GET'])
+@require_auth
+def get_user_uploads():
+    """获取当前用户的所有上传文件列表"""
+    try:
+        # 获取当前用户信息
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
+        
+        with get_db() as conn:
+            cursor = conn.cursor()
+            
+            # 索引未变化时直接返回304
+            etag = catalog_etag(get_catalog_version(conn), user_uuid)
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
+            
+            # 传入limit或after时按游标分页返回
+            if 'limit' in request.args or 'after' in request.args:
+                limit, after = parse_page_args(request.args)
+                rows, next_cursor = query_catalog_page(conn, limit, after, user_uuid=user_uuid)
+                files = [catalog_row_to_file_info(row) for row in rows]
+                response = jsonify({
+                    'files': files,
+                    'count': len(files),
+                    'has_more': next_cursor is not None,
+                    'next_cursor': next_cursor,
+                    'user_uuid': user_uuid
+                })
+            else:
+                # 从uploads索引读取，按创建时间倒序排列
+                cursor.execute(
+                    'SELECT * FROM uploads WHERE user_uuid = ? ORDER BY created_at DESC, id DESC',
+                    (user_uuid,)
+                )
+                files = [catalog_row_to_file_info(row) for row in cursor.fetchall()]
+                response = jsonify({
+                    'files': files,
+                    'total': len(files),
+                    'user_uuid': user_uuid
+                })
+        
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"获取用户文件列表错误: {str(e)}")
         return jsonify({'error': f'获取文件列表失败: {str(e)}'}), 500
 
 @app.route('/api/contexts/list', methods=['GET'])
+@rate_limit('contexts_list')
 def get_all_contexts():
     """获取所有用户的上下文文件列表（公开API，用于ContextList页面）"""
     try:
-        all_files = []
+        limit, after = parse_page_args(request.args)
         
-        # 检查upload目录是否存在
-        if not os.path.exists(UPLOAD_FOLDER):
-            return jsonify({'files': [], 'total': 0})
-        
-        # 遍历所有用户目录
-        for user_uuid in os.listdir(UPLOAD_FOLDER):
-            user_upload_dir = os.path.join(UPLOAD_FOLDER, user_uuid)
-            
-            # 跳过非目录文件
-            if not os.path.isdir(user_upload_dir):
-                continue
+        # 从uploads索引按(created_at, id)倒序分页读取
+        with get_db() as conn:
             
-            # 获取用户信息（可选，如果获取失败就使用UUID）
-            user_name = user_uuid[:8] + "..."  # 默认显示UUID前8位
-            try:
-                with sqlite3.connect(DATABASE) as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT name FROM users WHERE uuid = ?', (user_uuid,))
-                    user_row = cursor.fetchone()
-                    if user_row:
-                        user_name = user_row['name']
-            except:
-                # 如果获取用户信息失败，继续使用默认名称
-                pass
+            # 索引未变化时直接返回304
+            etag = catalog_etag(get_catalog_version(conn), 'all')
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
             
-            # 使用与get_user_uploads相同的逻辑处理文件
-            processed_files = set()
+            rows, next_cursor = query_catalog_page(conn, limit, after)
             
-            for filename in os.listdir(user_upload_dir):
-                file_path = os.path.join(user_upload_dir, filename)
-                
-                # 跳过目录
-                if os.path.isdir(file_path):
-                    continue
-                
-                try:
-                    # 解析时间戳
-                    name_without_ext, file_extension = os.path.splitext(filename)
-                    
-                    # 处理.specs文件
-                    if filename.endswith('.specs'):
-                        # 尝试从文件名中提取时间戳
-                        if '_context_' in name_without_ext:
-                            # 项目格式：projectname_context_timestamp
-                            timestamp_part = name_without_ext.split('_context_')[-1]
-                            # 处理ISO格式时间戳：2025-07-26_03-46-24-084Z
-                            timestamp = timestamp_part.replace('-', '').replace('Z', '')
-                        else:
-                            # 简单格式：直接使用文件名（去掉.specs）
-                            timestamp = name_without_ext
-                        
-                        # 避免重复处理
-                        if timestamp in processed_files:
-                            continue
-                        processed_files.add(timestamp)
-                        
-                        # 获取文件统计信息
-                        file_stat = os.stat(file_path)
-                        file_size = file_stat.st_size
-                        created_time = datetime.fromtimestamp(file_stat.st_ctime)
-                        modified_time = datetime.fromtimestamp(file_stat.st_mtime)
-                        
-                        # 从.specs文件中获取元数据
-                        file_metadata = {
-                            'name': f"上传文件: {filename}",
-                            'task_type': 'general_chat',
-                            'source_file': filename
-                        }
-                        
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as specs_file:
-                                specs_content = json.load(specs_file)
-                                # 安全访问可选的metadata字段
-                                if specs_content and 'metadata' in specs_content and specs_content['metadata']:
-                                    metadata = specs_content['metadata']
-                                    file_metadata.update({
-                                        'name': metadata.get('name') or file_metadata['name'],
-                                        'task_type': metadata.get('task_type') or file_metadata['task_type'],
-                                        'source_file': metadata.get('source_file') or file_metadata['source_file']
-                                    })
-                        except (json.JSONDecodeError, IOError, TypeError):
-                            # 如果.specs文件损坏，使用默认元数据
-                            pass
-                        
-                        # 构建文件信息
-                        file_info = {
-                            'id': f"{user_uuid}_{timestamp}",  # 全局唯一ID
-                            'timestamp': timestamp,
-                            'original_name': file_metadata['source_file'],
-                            'saved_name': filename,
-                            'size': file_size,
-                            'created_at': created_time.isoformat(),
-                            'modified_at': modified_time.isoformat(),
-                            'name': file_metadata['name'],
-                            'task_type': file_metadata['task_type'],
-                            'source_file': file_metadata['source_file'],
-                            'specs_file': filename,
-                            'access_url': f"/api/{user_uuid}/{timestamp}.html",
-                            'user_uuid': user_uuid,
-                            'user_name': user_name
-                        }
-                        
-                        all_files.append(file_info)
-                        
-                    # 检查是否为时间戳格式的原始文件
-                    elif len(name_without_ext) == 18 and '_' in name_without_ext:
-                        timestamp = name_without_ext
-                        
-                        # 避免重复处理
-                        if timestamp in processed_files:
-                            continue
-                        processed_files.add(timestamp)
-                        
-                        # 获取文件统计信息
-                        file_stat = os.stat(file_path)
-                        file_size = file_stat.st_size
-                        created_time = datetime.fromtimestamp(file_stat.st_ctime)
-                        modified_time = datetime.fromtimestamp(file_stat.st_mtime)
-                        
-                        # 检查是否存在对应的.specs文件
-                        specs_filename = f"{timestamp}.specs"
-                        specs_path = os.path.join(user_upload_dir, specs_filename)
-                        
-                        # 尝试从.specs文件中获取元数据
-                        file_metadata = {
-                            'name': f"上传文件: {filename}",
-                            'task_type': 'document_analysis',
-                            'source_file': filename
-                        }
-                        
-                        if os.path.exists(specs_path):
-                            try:
-                                with open(specs_path, 'r', encoding='utf-8') as specs_file:
-                                    specs_content = json.load(specs_file)
-                                    # 安全访问可选的metadata字段
-                                    if specs_content and 'metadata' in specs_content and specs_content['metadata']:
-                                        metadata = specs_content['metadata']
-                                        file_metadata.update({
-                                            'name': metadata.get('name') or file_metadata['name'],
-                                            'task_type': metadata.get('task_type') or file_metadata['task_type'],
-                                            'source_file': metadata.get('source_file') or file_metadata['source_file']
-                                        })
-                            except (json.JSONDecodeError, IOError, TypeError):
-                                # 如果.specs文件损坏，使用默认元数据
-                                pass
-                        
-                        # 构建文件信息
-                        file_info = {
-                            'id': f"{user_uuid}_{timestamp}",  # 全局唯一ID
-                            'timestamp': timestamp,
-                            'original_name': filename,
-                            'saved_name': filename,
-                            'size': file_size,
-                            'created_at': created_time.isoformat(),
-                            'modified_at': modified_time.isoformat(),
-                            'name': file_metadata['name'],
-                            'task_type': file_metadata['task_type'],
-                            'source_file': file_metadata['source_file'],
-                            'specs_file': specs_filename if os.path.exists(specs_path) else None,
-                            'access_url': f"/api/{user_uuid}/{timestamp}.html",
-                            'user_uuid': user_uuid,
-                            'user_name': user_name
-                        }
-                        
-                        all_files.append(file_info)
-                        
-                except Exception as file_error:
-                    app.logger.warning(f"处理文件 {filename} 时出错: {str(file_error)}")
-                    continue
+            # 一次批量查询本页涉及的所有用户名
+            user_names = get_user_names(conn, {row['user_uuid'] for row in rows})
         
-        # 按创建时间倒序排列
-        all_files.sort(key=lambda x: x['created_at'], reverse=True)
+        all_files = []
+        for row in rows:
+            user_uuid = row['user_uuid']
+            file_info = catalog_row_to_file_info(row)
+            # 内容哈希只返回给文件所有者，公开列表中不暴露
+            file_info.pop('content_hash', None)
+            file_info.update({
+                'id': f"{user_uuid}_{row['timestamp']}",  # 全局唯一ID
+                'user_uuid': user_uuid,
+                # 获取不到用户信息时默认显示UUID前8位
+                'user_name': user_names.get(user_uuid) or user_uuid[:8] + "..."
+            })
+            all_files.append(file_info)
         
-        return jsonify({
+        response = jsonify({
             'files': all_files,
-            'total': len(all_files)
+            'count': len(all_files),
+            'has_more': next_cursor is not None,
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"获取全局文件列表错误: {str(e)}")
         return jsonify({'error': f'获取文件列表失败: {str(e)}'}), 500
@@ -1063,33 +4116,45 @@ def delete_user_file(timestamp):
     """删除用户上传的文件"""
     try:
         # 获取当前用户信息
-        user_id = request.current_user['user_id']
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT uuid FROM users WHERE id = ?', (user_id,))
-            user_row = cursor.fetchone()
-            
-            if not user_row:
-                return jsonify({'error': '用户不存在'}), 404
-            
-            user_uuid = user_row['uuid']
-        
-        # 获取用户上传目录
-        user_upload_dir = get_user_upload_dir(user_uuid)
-        
-        # 查找并删除对应的文件
-        deleted_files = []
-        for filename in os.listdir(user_upload_dir):
-            if filename.startswith(timestamp):
-                file_path = os.path.join(user_upload_dir, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    deleted_files.append(filename)
+        user_uuid = get_current_user_uuid()
+        if not user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
         
-        if not deleted_files:
+        # 按uploads索引定位文件及其specs，直接删除对应路径，不列目录
+        with get_db() as conn:
+            row = conn.execute(
+                'SELECT saved_name, specs_file, stored_size FROM uploads WHERE user_uuid = ? AND timestamp = ?',
+                (user_uuid, timestamp)
+            ).fetchone()
+        if not row:
             return jsonify({'error': '文件不存在'}), 404
         
+        # 同步删除uploads索引记录并释放blob引用，引用归零的blob一并删除
+        with blob_lock:
+            deleted_files = []
+            for filename in dict.fromkeys(name for name in (row['saved_name'], row['specs_file']) if name):
+                file_path = get_upload_path(user_uuid, filename)
+                if not os.path.isfile(file_path):
+                    continue
+                os.remove(file_path)
+                for suffix in PRECOMPRESSED_SUFFIXES.values():
+                    if os.path.exists(file_path + suffix):
+                        os.remove(file_path + suffix)
+                deleted_files.append(filename)
+            
+            with get_db() as conn:
+                content_hashes = [row['content_hash'] for row in conn.execute(
+                    'SELECT content_hash FROM uploads WHERE user_uuid = ? AND timestamp = ? AND content_hash IS NOT NULL',
+                    (user_uuid, timestamp)
+                ).fetchall()]
+                cursor = conn.execute('DELETE FROM uploads WHERE user_uuid = ? AND timestamp = ?', (user_uuid, timestamp))
+                if cursor.rowcount:
+                    storage_add(conn, user_uuid, -row['stored_size'], -1)
+                unreferenced = blob_release(conn, content_hashes)
+                bump_catalog_version(conn)
+                conn.commit()
+            remove_unreferenced_blobs(unreferenced)
+        
         return jsonify({
             'success': True,
             'message': f'成功删除 {len(deleted_files)} 个文件',
@@ -1106,68 +4171,435 @@ def download_user_file(user_uuid, filename):
     """下载用户上传的文件"""
     try:
         # 获取当前用户信息
-        user_id = request.current_user['user_id']
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT uuid FROM users WHERE id = ?', (user_id,))
-            user_row = cursor.fetchone()
-            
-            if not user_row:
-                return jsonify({'error': '用户不存在'}), 404
-            
-            current_user_uuid = user_row['uuid']
+        current_user_uuid = get_current_user_uuid()
+        if not current_user_uuid:
+            return jsonify({'error': '用户不存在'}), 404
         
         # 安全检查：确保用户只能下载自己的文件
         if current_user_uuid != user_uuid:
             return jsonify({'error': '无权访问此文件'}), 403
         
         # 构建文件路径
-        user_upload_dir = get_user_upload_dir(user_uuid)
-        file_path = os.path.join(user_upload_dir, secure_filename(filename))
+        file_path = get_upload_path(user_uuid, secure_filename(filename))
         
         # 检查文件是否存在
         if not os.path.exists(file_path) or not os.path.isfile(file_path):
             return jsonify({'error': '文件不存在'}), 404
         
-        # 发送文件
-        from flask import send_file
-        return send_file(
-            file_path,
+        saved_name = os.path.basename(file_path)
+        # 下载是所有者导出文件的途径，.specs默认拼接全部拆出的字段返回完整文档；
+        # 传入空的include参数时只下载主文档
+        if 'include' in request.args:
+            include = parse_include_args(request.args)
+        else:
+            include = list(SPLIT_SECTIONS)
+        
+        # 以ingest时计算的内容哈希作为强ETag，If-Range据此判断断点续传的分段是否仍然有效
+        with get_db() as conn:
+            row = conn.execute(
+                'SELECT content_hash, sections, split_sections FROM uploads '
+                'WHERE user_uuid = ? AND timestamp = ? AND saved_name = ?',
+                (user_uuid, parse_upload_timestamp(saved_name), saved_name)
+            ).fetchone()
+        etag = row['content_hash'] if row and row['content_hash'] else compute_file_etag(file_path)
+        
+        included = {}
+        if include and saved_name.endswith('.specs') and row and row['split_sections']:
+            side_paths = blob_side_paths(row['content_hash'], json.loads(row['split_sections']))
+            included = {key: side_paths[key] for key in include if key in side_paths}
+        
+        # 鉴权通过后交给前端代理发送，不占用工作线程
+        if DOWNLOAD_OFFLOAD in ('x-accel-redirect', 'x-sendfile') and not included:
+            response = offload_download_response(file_path, saved_name)
+            response.cache_control.private = True
+            return response
+        
+        # 拆分过的.specs在主文档之后拼接拆出的字段（流式拼接，不支持Range）
+        if included:
+            etag = f"{etag}-{'+'.join(included)}"
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
+            response = specs_with_sections_response(file_path, bool(row['sections']), included)
+            response.mimetype = 'application/octet-stream'
+            response.headers['Content-Disposition'] = f'attachment; filename="{saved_name}"'
+            response.headers['Accept-Ranges'] = 'none'
+            response.set_etag(etag)
+            response.cache_control.private = True
+            return response
+        
+        # 发送文件，客户端支持时直接发送预压缩副本；每种编码的ETag不同，Range按所发送的字节计算
+        send_path, encoding = select_precompressed(file_path)
+        response = send_file(
+            send_path,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/octet-stream'
+            mimetype='application/octet-stream',
+            etag=f"{etag}-{encoding}" if encoding else etag,
+            conditional=True
         )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.private = True
+        return response
         
+    except RequestedRangeNotSatisfiable as e:
+        return e
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"下载文件错误: {str(e)}")
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
+def offload_download_response(file_path, download_name):
+    """生成由前端代理发送文件内容的空响应，Range/If-Range等条件请求同样由代理处理"""
+    response = app.response_class(mimetype='application/octet-stream')
+    if DOWNLOAD_OFFLOAD == 'x-accel-redirect':
+        relative_path = os.path.relpath(file_path, UPLOAD_FOLDER).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative_path)
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(file_path)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    return response
+
+def parse_json_pointer(pointer):
+    """解析JSON Pointer (RFC 6901)，返回路径片段列表；省略开头的/时按顶层字段处理"""
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        pointer = '/' + pointer
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+def parse_projection_args(args):
+    """解析fields和slice参数，返回(字段路径列表, [(路径, start, end)])，格式错误时抛出ValueError
+
+    fields为逗号分隔（或重复传入）的JSON Pointer；slice形如history:0:50，end可省略。
+    """
+    fields = []
+    for value in args.getlist('fields'):
+        fields.extend(parse_json_pointer(field.strip()) for field in value.split(',') if field.strip())
+
+    slices = []
+    for value in args.getlist('slice'):
+        for spec in value.split(','):
+            path, _, bounds = spec.strip().partition(':')
+            start, _, end = bounds.partition(':')
+            try:
+                start = int(start) if start else 0
+                end = int(end) if end else None
+            except ValueError:
+                raise ValueError(f'无效的slice参数: {spec}')
+            if start < 0 or (end is not None and end < start):
+                raise ValueError(f'无效的slice参数: {spec}')
+            slices.append((parse_json_pointer(path), start, end))
+    return fields, slices
+
+def parse_include_args(args):
+    """解析include参数，返回需要附带的拆出字段列表，未知字段抛出ValueError"""
+    include = []
+    for value in args.getlist('include'):
+        for key in value.split(','):
+            key = key.strip()
+            if not key:
+                continue
+            if key not in SPLIT_SECTIONS:
+                raise ValueError(f'无效的include参数: {key}')
+            if key not in include:
+                include.append(key)
+    return include
+
+def specs_with_sections_response(specs_path, has_members, side_paths):
+    """在主文档末尾拼接拆出的字段，以流式响应返回完整JSON
+
+    主文档由split_specs_file写出，最后一个字节是闭合的}。
+    """
+    prefixes = {}
+    for key in side_paths:
+        prefixes[key] = (b',' if has_members or prefixes else b'') + json.dumps(key).encode('utf-8') + b':'
+    body_size = os.path.getsize(specs_path) - 1
+    content_length = body_size + 1 + sum(
+        len(prefixes[key]) + os.path.getsize(path) for key, path in side_paths.items()
+    )
+
+    def generate():
+        with open(specs_path, 'rb') as f:
+            remaining = body_size
+            while remaining > 0:
+                chunk = f.read(min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        for key, path in side_paths.items():
+            yield prefixes[key]
+            with open(path, 'rb') as f:
+                yield from iter(lambda: f.read(64 * 1024), b'')
+        yield b'}'
+
+    response = app.response_class(generate(), mimetype='application/json')
+    response.content_length = content_length
+    return response
+
+class SpecsSectionReader:
+    """按uploads.sections记录的字节区间读取specs的顶层字段，每个字段只在用到时解析一次
+
+    没有区间索引（升级前未重建索引的文件）时整体解析文件。拆出到side文件的字段
+    只有在include中或被fields显式指定时才读取。
+    """
+
+    def __init__(self, specs_path, sections, side_paths=None, include=()):
+        self.specs_path = specs_path
+        self.sections = sections
+        self.side_paths = side_paths or {}
+        self.include = [key for key in include if key in self.side_paths]
+        self._loaded = {}
+        self._document = None
+        self.bytes_read = 0
+
+    def keys(self):
+        if self.sections is None:
+            return list(self._load_document().keys())
+        return list(self.sections.keys()) + self.include
+
+    def _load_document(self):
+        if self._document is None:
+            with open(self.specs_path, 'rb') as f:
+                raw = f.read()
+            self.bytes_read += len(raw)
+            self._document = json.loads(raw)
+        return self._document
+
+    def section(self, key):
+        """返回顶层字段的值，不存在时抛出KeyError"""
+        if self.sections is None:
+            return self._load_document()[key]
+        if key not in self._loaded:
+            if key in self.side_paths:
+                with open(self.side_paths[key], 'rb') as f:
+                    raw = f.read()
+            else:
+                start, end = self.sections[key]
+                with open(self.specs_path, 'rb') as f:
+                    f.seek(start)
+                    raw = f.read(end - start)
+            self.bytes_read += len(raw)
+            self._loaded[key] = json.loads(raw)
+        return self._loaded[key]
+
+    def slice_section(self, key, start, end):
+        """返回数组字段[start:end]的元素和数组总长度，字段不存在时抛出KeyError，不是数组时返回None
+
+        有区间索引且字段尚未解析时从字段起始偏移流式扫描，只解析切片范围内的元素。
+        """
+        if self.sections is None or key in self._loaded or key in self.side_paths:
+            value = self.section(key)
+            if not isinstance(value, list):
+                return None
+            return value[start:end], len(value)
+        section_start, section_end = self.sections[key]
+        with open(self.specs_path, 'rb') as f:
+            f.seek(section_start)
+            if f.read(1) != b'[':
+                return None
+            f.seek(section_start)
+            scanner = SpecsScanner(f)
+            scanner.base = section_start
+            items, total = scanner.array_items(start, end)
+        self.bytes_read += scanner.bytes_read
+        return [json.loads(raw) for raw in items], total
+
+    def resolve(self, tokens):
+        """按路径片段取值，不存在时抛出KeyError"""
+        if not tokens:
+            return {key: self.section(key) for key in self.keys()}
+        value = self.section(tokens[0])
+        for token in tokens[1:]:
+            if isinstance(value, list):
+                if not token.isdigit() or int(token) >= len(value):
+                    raise KeyError(token)
+                value = value[int(token)]
+            elif isinstance(value, dict):
+                value = value[token]
+            else:
+                raise KeyError(token)
+        return value
+
+def set_projected_value(target, tokens, value):
+    """按路径片段把值写入投影结果，中间层级按对象创建"""
+    if not tokens:
+        return value
+    current = target
+    for token in tokens[:-1]:
+        if isinstance(current, list):
+            current = current[int(token)]
+        else:
+            current = current.setdefault(token, {})
+    if isinstance(current, list):
+        current[int(tokens[-1])] = value
+    else:
+        current[tokens[-1]] = value
+    return target
+
+def project_specs(reader, fields, slices):
+    """按字段投影和数组切片生成响应内容，只读取涉及的顶层字段
+
+    顶层数组字段的切片由slice_section流式读取，不解析整个数组；未指定fields时被切片的
+    顶层字段先占位，保持原文档的字段顺序。
+    """
+    sliced_keys = {tokens[0] for tokens, _, _ in slices if len(tokens) == 1}
+    if fields:
+        result = {}
+        for tokens in fields:
+            try:
+                result = set_projected_value(result, tokens, reader.resolve(tokens))
+            except KeyError:
+                continue
+    else:
+        result = {key: None if key in sliced_keys else reader.section(key) for key in reader.keys()}
+
+    slice_info = {}
+    for tokens, start, end in slices:
+        path = '/' + '/'.join(token.replace('~', '~0').replace('/', '~1') for token in tokens)
+        try:
+            if len(tokens) == 1:
+                sliced = reader.slice_section(tokens[0], start, end)
+            else:
+                value = reader.resolve(tokens)
+                sliced = (value[start:end], len(value)) if isinstance(value, list) else None
+        except KeyError:
+            continue
+        if sliced is None:
+            raise ValueError(f'{path}不是数组，无法切片')
+        items, total = sliced
+        result = set_projected_value(result, tokens, items)
+        slice_info[path] = {
+            'start': start,
+            'end': min(end, total) if end is not None else total,
+            'total': total
+        }
+    if slice_info and isinstance(result, dict):
+        result['_slices'] = slice_info
+    return result
+
 @app.route('/api/<user_uuid>/<timestamp>.html', methods=['GET'])
+@rate_limit('specs_content')
 def get_specs_content(user_uuid, timestamp):
     """获取用户的specs文件内容（公开访问）"""
     try:
         # 构建specs文件路径
-        user_upload_dir = os.path.join(UPLOAD_FOLDER, user_uuid)
         specs_filename = f"{timestamp}.specs"
-        specs_path = os.path.join(user_upload_dir, specs_filename)
+        specs_path = get_upload_path(user_uuid, specs_filename)
         
         # 检查文件是否存在
         if not os.path.exists(specs_path) or not os.path.isfile(specs_path):
             return jsonify({'error': '文件不存在'}), 404
         
-        # 读取并返回specs文件内容
-        with open(specs_path, 'r', encoding='utf-8') as f:
-            specs_content = json.load(f)
+        # 以ingest时计算的内容哈希作为强ETag，带时间戳的specs地址内容不可变
+        with get_db() as conn:
+            row = conn.execute(
+                'SELECT content_hash, sections, split_sections FROM uploads '
+                'WHERE user_uuid = ? AND timestamp = ? AND saved_name = ?',
+                (user_uuid, timestamp, specs_filename)
+            ).fetchone()
+        etag = row['content_hash'] if row and row['content_hash'] else compute_file_etag(specs_path)
+        sections = json.loads(row['sections']) if row and row['sections'] else None
+        
+        # raw_api_response等拆出的字段默认不返回，include=raw_api_response时从side文件读取
+        include = parse_include_args(request.args)
+        side_paths = {}
+        if row and row['split_sections']:
+            side_paths = blob_side_paths(row['content_hash'], json.loads(row['split_sections']))
+        
+        # fields/slice：只读取涉及的顶层字段，按uploads.sections记录的字节区间定位
+        if 'fields' in request.args or 'slice' in request.args:
+            fields, slices = parse_projection_args(request.args)
+            query_digest = hashlib.sha256(request.query_string).hexdigest()[:16]
+            etag = f"{etag}-{query_digest}"
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
+            
+            reader = SpecsSectionReader(specs_path, sections, side_paths, include)
+            response = jsonify(project_specs(reader, fields, slices))
+            response.set_etag(etag)
+            response.cache_control.max_age = SPECS_CACHE_MAX_AGE
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+        
+        included = {key: side_paths[key] for key in include if key in side_paths}
+        if included:
+            # 主文档之后依次拼接side文件，不整体解析
+            etag = f"{etag}-{'+'.join(included)}"
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
+            response = specs_with_sections_response(specs_path, bool(sections), included)
+            response.set_etag(etag)
+            response.cache_control.max_age = SPECS_CACHE_MAX_AGE
+        # 上传时已校验过格式，直接以文件流返回磁盘上的字节
+        # 客户端支持时发送上传时生成的预压缩副本，不在请求中压缩
+        elif SPECS_PASSTHROUGH:
+            send_path, encoding = select_precompressed(specs_path)
+            response = send_file(
+                send_path,
+                mimetype='application/json',
+                etag=f"{etag}-{encoding}" if encoding else etag,
+                max_age=SPECS_CACHE_MAX_AGE
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+        else:
+            if request.if_none_match.contains(etag):
+                return not_modified_response(etag)
+            
+            # 读取并返回specs文件内容
+            with open(specs_path, 'r', encoding='utf-8') as f:
+                specs_content = json.load(f)
+            
+            response = jsonify(specs_content)
+            response.set_etag(etag)
+            response.cache_control.max_age = SPECS_CACHE_MAX_AGE
         
-        return jsonify(specs_content)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
         
+    except RequestedRangeNotSatisfiable as e:
+        # 与下载接口一致，Range超出文件大小时返回416而不是500
+        return e
     except json.JSONDecodeError:
         return jsonify({'error': 'specs文件格式错误'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"获取specs文件错误: {str(e)}")
         return jsonify({'error': f'获取文件内容失败: {str(e)}'}), 500
 
+@app.route('/api/system/stats', methods=['GET'])
+@require_stats_access
+def system_stats():
+    """运行时缓存统计"""
+    with get_db() as conn:
+        storage = conn.execute(
+            'SELECT COUNT(*) AS users, COALESCE(SUM(bytes), 0) AS bytes, COALESCE(SUM(files), 0) AS files '
+            'FROM user_storage'
+        ).fetchone()
+    return jsonify({
+        'specs_metadata_cache': specs_metadata_cache.stats(),
+        'file_etag_cache': file_etag_cache.stats(),
+        'user_name_cache': user_name_cache.stats(),
+        'user_row_cache': user_row_cache.stats(),
+        'verified_token_cache': verified_token_cache.stats(),
+        'invalid_token_cache': invalid_token_cache.stats(),
+        'revocation_index': revocation_index.stats(),
+        'maintenance': maintenance_stats,
+        'jobs': job_pool.stats(),
+        'storage': dict(storage),
+        'rate_limit': rate_limiter.stats(),
+        'db_pool': db_pool.stats(),
+        'specs_scan': dict(specs_scan_stats)
+    })
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查"""
@@ -1179,6 +4611,7 @@ def health_check():
 
 if __name__ == '__main__':
     init_db()
+    start_background_services(debug=True)
     port = int(os.getenv('PORT', 5001))
     host = os.getenv('HOST', '0.0.0.0')
     app.run(debug=True, port=port, host=host)
\ No newline at end of file
@@ -13,7 +13,7 @@ load_dotenv()
 # 将当前目录添加到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, init_db
+from app import app, init_db, start_background_services
 
 if __name__ == '__main__':
     # 初始化数据库
@@ -24,6 +24,9 @@ if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     debug = os.getenv('FLASK_ENV') == 'development'
     
+    # 启动后台维护任务
+    start_background_services(debug=debug)
+    
     print(f"启动 Web-Spec 后端服务...")
     print(f"地址: http://{host}:{port}")
     print(f"调试模式: {debug}")
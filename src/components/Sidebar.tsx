@@ -7,9 +7,11 @@ interface SidebarProps {
   selectedSort: string
   onCategoryChange: (category: string) => void
   onSortChange: (sort: string) => void
+  // 暂不可用的排序方式（例如列表只加载了部分分页时按文件名/大小排序）
+  disabledSorts?: string[]
 }
 
-export function Sidebar({ selectedSort, onCategoryChange, onSortChange }: SidebarProps) {
+export function Sidebar({ selectedSort, onCategoryChange, onSortChange, disabledSorts = [] }: SidebarProps) {
   const navigate = useNavigate()
   const location = useLocation()
   
@@ -88,16 +90,20 @@ export function Sidebar({ selectedSort, onCategoryChange, onSortChange }: Sideba
           {sortOptions.map((option, index) => {
             const Icon = option.icon
             const isActive = selectedSort === option.id
+            const isDisabled = disabledSorts.includes(option.id)
             
             return (
               <li key={option.id} className={index < sortOptions.length - 1 ? 'mb-3' : ''}>
                 <button
                   onClick={() => onSortChange(option.id)}
+                  disabled={isDisabled}
+                  title={isDisabled ? '加载全部文件后可用' : undefined}
                   className={cn(
                     "flex items-center text-sm w-full text-left",
                     isActive 
                       ? "font-medium" 
-                      : "hover:text-gray-900"
+                      : "hover:text-gray-900",
+                    isDisabled && "opacity-50 cursor-not-allowed"
                   )}
                   style={{ 
                     color: isActive 
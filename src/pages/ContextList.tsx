@@ -9,6 +9,9 @@ import type { ContextFile } from '@/types/context'
 import type { User } from '@/types/user'
 
 
+// 每页加载的文件数
+const PAGE_SIZE = 30
+
 interface ContextListProps {
   user: User | null
   onLogout: () => void
@@ -26,6 +29,8 @@ export function ContextList({ user, onLogout }: ContextListProps) {
   const [selectedSort, setSelectedSort] = useState('updated')
   const [viewMode, setViewMode] = useState<'grid' | 'list'>('grid')
   const [searchQuery, setSearchQuery] = useState('')
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [isLoadingMore, setIsLoadingMore] = useState(false)
 
   // 将GlobalContextFile转换为ContextFile格式
   const convertToContextFile = (globalFile: GlobalContextFile): ContextFile => {
@@ -47,8 +52,9 @@ export function ContextList({ user, onLogout }: ContextListProps) {
       setIsLoading(true)
       setError(null)
       
-      const response = await contextsApi.getAllContexts()
+      const response = await contextsApi.getAllContexts({ limit: PAGE_SIZE })
       setGlobalFiles(response.files)
+      setNextCursor(response.next_cursor)
       
       // 转换为ContextFile格式
       const convertedContexts = response.files.map(convertToContextFile)
@@ -62,6 +68,25 @@ export function ContextList({ user, onLogout }: ContextListProps) {
     }
   }
 
+  // 加载下一页
+  const loadMoreContexts = async () => {
+    if (!nextCursor) return
+    try {
+      setIsLoadingMore(true)
+      
+      const response = await contextsApi.getAllContexts({ limit: PAGE_SIZE, after: nextCursor })
+      setGlobalFiles(prev => [...prev, ...response.files])
+      setNextCursor(response.next_cursor)
+      setContexts(prev => [...prev, ...response.files.map(convertToContextFile)])
+      
+    } catch (err) {
+      console.error('加载更多文件失败:', err)
+      setError(err instanceof Error ? err.message : '加载文件列表失败')
+    } finally {
+      setIsLoadingMore(false)
+    }
+  }
+
   // 刷新数据
   const handleRefresh = () => {
     loadGlobalContexts()
@@ -105,15 +130,21 @@ export function ContextList({ user, onLogout }: ContextListProps) {
     // Here you would handle sharing functionality
   }
 
+  // 还有未加载的分页时，按文件名/大小排序和搜索只能覆盖已加载的部分，结果会误导，
+  // 因此暂时禁用，按服务端顺序（最新在前）展示，全部加载后恢复
+  const hasMorePages = nextCursor !== null
+  const effectiveSort = hasMorePages ? 'updated' : selectedSort
+  const effectiveQuery = hasMorePages ? '' : searchQuery
+
   const filteredContexts = contexts.filter(context => {
-    const matchesSearch = context.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-                         context.description.toLowerCase().includes(searchQuery.toLowerCase())
+    const matchesSearch = context.name.toLowerCase().includes(effectiveQuery.toLowerCase()) ||
+                         context.description.toLowerCase().includes(effectiveQuery.toLowerCase())
     const matchesCategory = selectedCategory === 'all' || selectedCategory === 'my'
     return matchesSearch && matchesCategory
   })
 
   const sortedContexts = [...filteredContexts].sort((a, b) => {
-    switch (selectedSort) {
+    switch (effectiveSort) {
       case 'name':
         return a.name.localeCompare(b.name)
       case 'updated':
@@ -138,9 +169,10 @@ export function ContextList({ user, onLogout }: ContextListProps) {
       
       <div className="flex w-full">
         <Sidebar
-          selectedSort={selectedSort}
+          selectedSort={effectiveSort}
           onCategoryChange={setSelectedCategory}
           onSortChange={setSelectedSort}
+          disabledSorts={hasMorePages ? ['name', 'size'] : []}
         />
         
         <main className="flex-1 pt-6 pr-6 pb-6 pl-6">
@@ -151,7 +183,7 @@ export function ContextList({ user, onLogout }: ContextListProps) {
                 className="text-sm"
                 style={{ color: 'rgba(136, 138, 139, 1)' }}
               >
-                {isLoading ? '加载中...' : `共${sortedContexts.length}个文件`}
+                {isLoading ? '加载中...' : hasMorePages ? `已加载${sortedContexts.length}个文件` : `共${sortedContexts.length}个文件`}
               </span>
             </div>
             
@@ -159,10 +191,11 @@ export function ContextList({ user, onLogout }: ContextListProps) {
               <div className="relative mr-3">
                 <input
                   type="text"
-                  placeholder="搜索所有用户的文件..."
-                  value={searchQuery}
+                  placeholder={hasMorePages ? '加载全部文件后可搜索' : '搜索所有用户的文件...'}
+                  value={effectiveQuery}
                   onChange={(e) => setSearchQuery(e.target.value)}
-                  className="input w-64 h-10 pr-10 pl-4"
+                  disabled={hasMorePages}
+                  className="input w-64 h-10 pr-10 pl-4 disabled:opacity-50"
                 />
                 <div className="absolute right-3 top-1/2 transform -translate-y-1/2">
                   <Search className="w-4 h-4" style={{ color: 'rgba(136, 138, 139, 1)' }} />
@@ -252,6 +285,19 @@ export function ContextList({ user, onLogout }: ContextListProps) {
                   ))}
                 </div>
               )}
+              
+              {/* 加载更多 */}
+              {nextCursor && (
+                <div className="flex justify-center mt-6">
+                  <button
+                    onClick={loadMoreContexts}
+                    disabled={isLoadingMore}
+                    className="px-4 py-2 rounded-md bg-gray-100 hover:bg-gray-200 disabled:opacity-50"
+                  >
+                    {isLoadingMore ? '加载中...' : '加载更多'}
+                  </button>
+                </div>
+              )}
             </>
           )}
         </main>
@@ -18,7 +18,21 @@ export interface GlobalContextFile {
 
 export interface GlobalContextsResponse {
   files: GlobalContextFile[]
-  total: number
+  count: number
+  has_more: boolean
+  next_cursor: string | null
+}
+
+export interface ContextsPageOptions {
+  limit?: number
+  after?: string | null
+}
+
+export interface SpecsContentOptions {
+  // JSON Pointer列表，例如 ['/metadata', '/compressed_context/context_summary']
+  fields?: string[]
+  // 数组切片，例如 ['history:0:50']
+  slice?: string[]
 }
 
 class ContextsApiService {
@@ -29,11 +43,21 @@ class ContextsApiService {
   }
 
   /**
-   * 获取所有用户的上下文文件列表
+   * 分页获取所有用户的上下文文件列表
+   * 传入上一页返回的next_cursor作为after获取下一页
    */
-  async getAllContexts(): Promise<GlobalContextsResponse> {
+  async getAllContexts(options: ContextsPageOptions = {}): Promise<GlobalContextsResponse> {
     try {
-      const response = await fetch(`${this.baseUrl}/api/contexts/list`, {
+      const params = new URLSearchParams()
+      if (options.limit) {
+        params.set('limit', String(options.limit))
+      }
+      if (options.after) {
+        params.set('after', options.after)
+      }
+      const query = params.toString()
+
+      const response = await fetch(`${this.baseUrl}/api/contexts/list${query ? `?${query}` : ''}`, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json',
@@ -54,10 +78,17 @@ class ContextsApiService {
 
   /**
    * 获取指定specs文件的内容
+   * 传入fields/slice时只返回所需字段，适合卡片等只展示摘要的场景
    */
-  async getSpecsContent(userUuid: string, timestamp: string): Promise<any> {
+  async getSpecsContent(userUuid: string, timestamp: string, options: SpecsContentOptions = {}): Promise<any> {
     try {
-      const response = await fetch(`${this.baseUrl}/api/${userUuid}/${timestamp}.html`, {
+      const params = new URLSearchParams()
+      if (options.fields?.length) params.set('fields', options.fields.join(','))
+      if (options.slice?.length) params.set('slice', options.slice.join(','))
+      const query = params.toString()
+      const url = `${this.baseUrl}/api/${userUuid}/${timestamp}.html${query ? `?${query}` : ''}`
+
+      const response = await fetch(url, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json',
@@ -13,6 +13,15 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import requests
 
+# Files at or above this size go through the resumable upload protocol
+RESUMABLE_THRESHOLD = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_RETRIES = 5
+# Multiple files are sent through /api/upload/batch in groups of this size
+BATCH_SIZE = 100
+# 429 responses are retried after the server's Retry-After delay
+MAX_RATE_LIMIT_RETRIES = 3
+
 def print_colored(color, *args):
     print(" ".join(map(str, args)))
 
@@ -34,7 +43,14 @@ class WebSpecUploader:
         
         try:
             # Use the session object for all requests
-            response = self.session.request(method, url, timeout=20, **kwargs)
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                response = self.session.request(method, url, timeout=20, **kwargs)
+                if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    break
+                wait = int(response.headers.get('Retry-After', '1'))
+                print(f"Rate limited, retrying in {wait}s...")
+                time.sleep(wait)
+                self._rewind_files(kwargs.get('files'))
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
@@ -43,6 +59,17 @@ class WebSpecUploader:
             print(f"Connection Error: {e}")
         return None
 
+    @staticmethod
+    def _rewind_files(files):
+        """Seek multipart file objects back to the start so a request can be resent."""
+        if not files:
+            return
+        entries = files.values() if isinstance(files, dict) else (value for _, value in files)
+        for entry in entries:
+            handle = entry[1] if isinstance(entry, tuple) else entry
+            if hasattr(handle, 'seek'):
+                handle.seek(0)
+
     def load_token(self):
         if os.path.exists(self.token_file):
             with open(self.token_file, 'r') as f:
@@ -147,10 +174,16 @@ class WebSpecUploader:
         print(f"Uploading '{filename}'...")
 
         try:
-            with open(file_path, 'rb') as f:
-                # The server will handle naming, we just send the file
-                files = {'file': (filename, f, 'application/octet-stream')}
-                data = self._api_request("post", "/api/upload", files=files)
+            data = self._upload_by_hash(file_path, filename)
+            if data:
+                print("✔ Identical content already in your uploads, skipped transfer.")
+            elif os.path.getsize(file_path) >= RESUMABLE_THRESHOLD:
+                data = self._upload_resumable(file_path, filename)
+            else:
+                with open(file_path, 'rb') as f:
+                    # The server will handle naming, we just send the file
+                    files = {'file': (filename, f, 'application/octet-stream')}
+                    data = self._api_request("post", "/api/upload", files=files)
             
             if data and data.get('success'):
                 info = data.get('file_info', {})
@@ -163,6 +196,111 @@ class WebSpecUploader:
         except Exception as e:
             print(f"An error occurred during upload: {e}")
 
+    def _upload_by_hash(self, file_path, filename):
+        """Register the file by sha256 if this account has already uploaded identical content."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/upload/by-hash",
+                json={'sha256': digest.hexdigest(), 'filename': filename},
+                headers={'Authorization': f"Bearer {self.load_token()}"},
+                timeout=20
+            )
+        except requests.exceptions.RequestException:
+            return None
+        return response.json() if response.status_code == 200 else None
+
+    def _upload_resumable(self, file_path, filename):
+        """Upload in chunks through an upload session, resuming from the server's offset after failures."""
+        size = os.path.getsize(file_path)
+        upload = self._api_request("post", "/api/upload/sessions", json={'filename': filename, 'size': size})
+        if not upload:
+            return None
+
+        endpoint = f"/api/upload/sessions/{upload['session_id']}"
+        chunk_size = min(upload.get('chunk_size', UPLOAD_CHUNK_SIZE), UPLOAD_CHUNK_SIZE)
+        offset = upload['offset']
+        retries = 0
+
+        with open(file_path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                try:
+                    response = self.session.put(
+                        f"{self.base_url}{endpoint}",
+                        data=chunk,
+                        headers={
+                            'Authorization': f"Bearer {self.load_token()}",
+                            'Content-Type': 'application/octet-stream',
+                            'Upload-Offset': str(offset)
+                        },
+                        timeout=120
+                    )
+                    if response.status_code in (200, 409):
+                        # 409 means our offset was stale; realign with the server's progress
+                        offset = response.json()['offset']
+                        if response.status_code == 200:
+                            retries = 0
+                            print(f"  -> {offset}/{size} bytes")
+                            continue
+                    else:
+                        print(f"API Error: {response.status_code}", response.text)
+                        if response.status_code < 500:
+                            return None
+                except requests.exceptions.RequestException as e:
+                    print(f"Connection Error: {e}")
+
+                retries += 1
+                if retries > MAX_CHUNK_RETRIES:
+                    print(f"Giving up after {MAX_CHUNK_RETRIES} retries at {offset}/{size} bytes.")
+                    return None
+                time.sleep(2 ** retries)
+                progress = self._api_request("get", endpoint)
+                if progress:
+                    offset = progress['offset']
+                    print(f"Resuming from {offset}/{size} bytes...")
+
+        return self._api_request("post", f"{endpoint}/complete")
+
+    def upload_files(self, file_paths):
+        """Upload several files, grouping small ones into batch requests."""
+        small = []
+        for file_path in file_paths:
+            if not os.path.isfile(file_path):
+                print(f"File not found: {file_path}")
+            elif os.path.getsize(file_path) >= RESUMABLE_THRESHOLD:
+                self.upload_file(file_path)
+            else:
+                small.append(file_path)
+
+        for start in range(0, len(small), BATCH_SIZE):
+            group = small[start:start + BATCH_SIZE]
+            print(f"Uploading {len(group)} files in one batch...")
+            handles = [open(path, 'rb') for path in group]
+            try:
+                files = [
+                    ('files', (os.path.basename(path), f, 'application/octet-stream'))
+                    for path, f in zip(group, handles)
+                ]
+                data = self._api_request("post", "/api/upload/batch", files=files)
+            finally:
+                for f in handles:
+                    f.close()
+
+            if not data:
+                print("Batch upload failed.")
+                continue
+            for result in data.get('results', []):
+                if result.get('success'):
+                    print(f"  ✔ {result['filename']} -> {result['file_info'].get('saved_name')}")
+                else:
+                    print(f"  ✘ {result['filename']}: {result.get('error')}")
+            print(f"✔ {data.get('uploaded')} uploaded, {data.get('failed')} failed.")
+
     def run(self, args):
         if args.reset:
             return self.clear_token()
@@ -171,12 +309,14 @@ class WebSpecUploader:
             if not self.authenticate():
                 return
         
-        if args.file:
-            self.upload_file(args.file)
+        if len(args.files) == 1:
+            self.upload_file(args.files[0])
+        elif args.files:
+            self.upload_files(args.files)
 
 def main():
     parser = argparse.ArgumentParser(description="Web-Spec Python CLI Uploader.")
-    parser.add_argument('file', nargs='?', help='Path to the .json file to upload.')
+    parser.add_argument('files', nargs='*', help='Paths of the files to upload.')
     parser.add_argument('--reset', action='store_true', help='Clear saved authentication token.')
     args = parser.parse_args()
     